@@ -5,12 +5,14 @@ Author:Mr Sosimple
 """
 
 
-import threading
+import os
+from collections import deque
 
 from PyQt5 import QtWidgets
 from PyQt5 import QtGui
 from PyQt5.QtWidgets import QMessageBox
 from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtCore import QTimer
 
 import sanxi_core
 import Sanxi_CtrlUI
@@ -36,15 +38,24 @@ class Sanxi_window(sanxi_core.Sanxi, QtWidgets.QWidget, Sanxi_CtrlUI.Ui_Sanxi_fo
         self.goline_pushButton.clicked.connect(self.goline_pushButton_clicked)
         self.goangle_pushButton.clicked.connect(self.goangle_pushButton_clicked)
         self.sendcode_pushButton.clicked.connect(self.sendcode_pushButton_clicked)
-        # display board-timer
-        # self.display_board_timer = QTimer(self)
-        # self.display_board_timer.start(1)
-        # self.display_board_timer.timeout.connect(self.display_board)
-        self.display_board_timer = threading.Timer(0.005, self.display_board)
-        self.display_board_timer.start()
+        self.program_runner = None  # 正在执行的程序，运行中再次点击发送按钮为暂停/继续
+        self.program_state = None
+        self.sendcode_text = self.sendcode_pushButton.text()
+        # display board-subscriptions：回送、状态与报错按到达顺序逐条显示，位姿只在坐标栏显示最新值
+        self.returncode_lines = deque(maxlen=1024)  # 解析线程写入，GUI 线程取出
+        self.echo_subscription = self.subscribe('echo', self.returncode_lines.append)
+        self.status_subscription = self.subscribe(
+            'status', lambda code: self.returncode_lines.append('Status: 0x{:02x}'.format(ord(code))))
+        self.error_subscription = self.subscribe('error', self.returncode_lines.append)
+        self.returncode_textBrowser.document().setMaximumBlockCount(1000)
+        self.joint_subscription = self.subscribe('joint', coalesce=True)
+        self.cartesian_subscription = self.subscribe('cartesian', coalesce=True)
+        # display board-timer，在 GUI 线程中刷新
+        self.display_board_timer = QTimer(self)
+        self.display_board_timer.timeout.connect(self.display_board)
+        self.display_board_timer.start(10)
         # display board-control button
         self.coordinate_display_mode_flag = 1  # 1为笛卡尔坐标  0位关节空间坐标
-        self.add_show_code = ''
         self.rectmode_pushButton.clicked.connect(self.rectmode_pushButton_clicked)
         self.anglemode_pushButton.clicked.connect(self.anglemode_pushButton_clicked)
         # single joint jogging
@@ -113,7 +124,10 @@ class Sanxi_window(sanxi_core.Sanxi, QtWidgets.QWidget, Sanxi_CtrlUI.Ui_Sanxi_fo
     def stop_pushButton_clicked(self):
         if not self.is_connected():
             self.not_connect_dialog()
-        self.stop()
+        if self.program_runner is not None and self.program_runner.state in ('running', 'paused'):
+            self.program_runner.abort()  # 中止程序，其中已发送 \x30
+        else:
+            self.stop()
 
     # 调用外部exe——三喜原厂软件
     def call_v51exe_pushButton_clicked(self):
@@ -126,23 +140,27 @@ class Sanxi_window(sanxi_core.Sanxi, QtWidgets.QWidget, Sanxi_CtrlUI.Ui_Sanxi_fo
                 self.disconnect()
         os.popen('V51.exe')
 
-    # 复位并退出：多线程模式下进行???????????????????????????????????
+    # 复位并退出：回原点结束(或超时)后由定时器在 GUI 线程中退出
     def resetq_pushButton_clicked(self):
         if not self.is_connected():
             self.not_connect_dialog()
         else:
-            resetquit_thread = threading.Thread(target=self.thread_func_reset_quit,
-                                                name='Thread-resetquit')
-            resetquit_thread.start()
-            resetquit_thread.join()
-            self.display_board_timer.cancel()  # 退出系统前停止其他线程和定时器
-            QCoreApplication.quit()
-
-    def thread_func_reset_quit(self):
-        self.back2origin(wait=True)
-        self.stop()
+            self.reset_quit_future = self.back2origin()
+            self.reset_quit_timer = QTimer(self)
+            self.reset_quit_timer.timeout.connect(self.reset_quit_check)
+            self.reset_quit_timer.start(20)
+
+    def reset_quit_check(self):
+        if not self.reset_quit_future.done():
+            return
+        self.reset_quit_timer.stop()
+        if self.reset_quit_future.exception() is not None:
+            print('Back to origin error: ', self.reset_quit_future.exception())
+        self.stop(wait=True)
         self.stop_update_sanxi_output()
         self.disconnect()
+        self.display_board_timer.stop()  # 退出系统前停止其他线程和定时器
+        QCoreApplication.quit()
 
     ##############################Fundamental Functions##############################
     # 读直角坐标文本框值
@@ -169,26 +187,54 @@ class Sanxi_window(sanxi_core.Sanxi, QtWidgets.QWidget, Sanxi_CtrlUI.Ui_Sanxi_fo
     def p2p_pushButton_clicked(self):
         rect_dict = self.read_rect_lineEdit()
         rect_dict['D'] = '0'
-        self.rect_move(mode='p2p', **rect_dict)
+        self.show_eta('cartesian', rect_dict)
+        self.show_rejection(self.rect_move(mode='p2p', **rect_dict))
 
     # 直角坐标直线运动
     def goline_pushButton_clicked(self):
         rect_dict = self.read_rect_lineEdit()
         rect_dict['D'] = '0'
-        self.rect_move(mode='line', **rect_dict)
+        self.show_eta('cartesian', rect_dict)
+        self.show_rejection(self.rect_move(mode='line', **rect_dict))
 
     # 按轴角度运动
     def goangle_pushButton_clicked(self):
         j_dict = self.read_angle_lineEdit()
-        self.multi_joints_motion(**j_dict)
+        self.show_eta('joint', j_dict)
+        self.show_rejection(self.multi_joints_motion(**j_dict))
+
+    # 在返回消息框中显示预计运动时间
+    def show_eta(self, space, target_dict):
+        try:
+            eta = self.estimate_move(space, target_dict)
+        except ValueError:
+            return
+        if eta is not None:
+            self.returncode_textBrowser.append('ETA {:.1f} s'.format(eta))
+
+    # 未通过发送前检查的运动不会发送，在返回消息框中显示原因
+    def show_rejection(self, future):
+        if future.done() and not future.cancelled() and future.exception() is not None:
+            self.returncode_textBrowser.append('Rejected: {}'.format(future.exception()))
+            self.returncode_textBrowser.moveCursor(QtGui.QTextCursor.End)
 
-    # 发送命令
+    # 发送命令：文本框中的多行命令，或只填一个程序文件路径时流式执行该文件
     def sendcode_pushButton_clicked(self):
-        data_list = self.sendcode_textEdit.toPlainText().split(sep='\n')  # 拆分多行命令，间隔0.1秒发送
-        self.changeto_mode14()
-        for send_data in data_list:
-            if send_data:
-                self.send(send_data + '\n')
+        runner = self.program_runner
+        if runner is not None and runner.state == 'running':
+            runner.pause()
+            return
+        if runner is not None and runner.state == 'paused':
+            runner.resume()
+            return
+        text = self.sendcode_textEdit.toPlainText().strip()
+        if not text:
+            return
+        if '\n' not in text and os.path.isfile(text):
+            program = text
+        else:
+            program = text.split(sep='\n')
+        self.program_runner = self.run_program(program)
 
     #########################sigle jiont jogging#########################
     # 单轴点动：pressed为按下按钮操作，clicked为松开按钮操作
@@ -271,35 +317,60 @@ class Sanxi_window(sanxi_core.Sanxi, QtWidgets.QWidget, Sanxi_CtrlUI.Ui_Sanxi_fo
         :return:
         """
         # print('enter display func')
-        if self.add_show_code != self.return_code:
-            # print('if 1')
-            # print(self.xyz_value)
+        lines = []
+        while self.returncode_lines:
+            lines.append(self.returncode_lines.popleft())
+        if lines:
             # refresh return_code text_browser
-            self.add_show_code = self.return_code
-            # print('add show code=', self.add_show_code)
-            self.returncode_textBrowser.append(self.add_show_code)
+            self.returncode_textBrowser.append('\n'.join(lines))
             self.returncode_textBrowser.moveCursor(QtGui.QTextCursor.End)
             # self.returncode_textBrowser.ensureCursorVisible()
-            # refresh value
-            if self.jn_value and self.coordinate_display_mode_flag==0:
-                # print(self.jn_value)
-                self.j1show_lineEdit.setText(self.jn_value[0])
-                self.j2show_lineEdit.setText(self.jn_value[1])
-                self.j3show_lineEdit.setText(self.jn_value[2])
-                self.j4show_lineEdit.setText(self.jn_value[3])
-                self.j5show_lineEdit.setText(self.jn_value[4])
-                self.j6show_lineEdit.setText(self.jn_value[5])
-            if self.xyz_value and self.coordinate_display_mode_flag==1:
-                # print('in xyz', self.xyz_value[1])
-                self.xshow_lineEdit.setText(self.xyz_value[0])
-                self.yshow_lineEdit.setText(self.xyz_value[1])
-                self.zshow_lineEdit.setText(self.xyz_value[2])
-                self.ashow_lineEdit.setText(self.xyz_value[3])
-                self.bshow_lineEdit.setText(self.xyz_value[4])
-                self.cshow_lineEdit.setText(self.xyz_value[5])
-        self.display_board_timer = threading.Timer(0.005, self.display_board)
-        self.display_board_timer.start()
+        # refresh value
+        for joint_pose in self.joint_subscription.poll():
+            if self.coordinate_display_mode_flag==0:
+                # print(joint_pose)
+                self.j1show_lineEdit.setText('{:.3f}'.format(joint_pose.values[0]))
+                self.j2show_lineEdit.setText('{:.3f}'.format(joint_pose.values[1]))
+                self.j3show_lineEdit.setText('{:.3f}'.format(joint_pose.values[2]))
+                self.j4show_lineEdit.setText('{:.3f}'.format(joint_pose.values[3]))
+                self.j5show_lineEdit.setText('{:.3f}'.format(joint_pose.values[4]))
+                self.j6show_lineEdit.setText('{:.3f}'.format(joint_pose.values[5]))
+        for cartesian_pose in self.cartesian_subscription.poll():
+            if self.coordinate_display_mode_flag==1:
+                # print('in xyz', cartesian_pose.values[1])
+                self.xshow_lineEdit.setText('{:.3f}'.format(cartesian_pose.values[0]))
+                self.yshow_lineEdit.setText('{:.3f}'.format(cartesian_pose.values[1]))
+                self.zshow_lineEdit.setText('{:.3f}'.format(cartesian_pose.values[2]))
+                self.ashow_lineEdit.setText('{:.3f}'.format(cartesian_pose.values[3]))
+                self.bshow_lineEdit.setText('{:.3f}'.format(cartesian_pose.values[4]))
+                self.cshow_lineEdit.setText('{:.3f}'.format(cartesian_pose.values[5]))
         # print('leave display func')
+        self.display_program_progress()
+
+    def display_program_progress(self):
+        """
+        在发送按钮上显示程序进度，程序结束时在返回消息框中报告结果
+        :return:
+        """
+        runner = self.program_runner
+        if runner is None:
+            return
+        progress = runner.get_progress()
+        state = progress['state']
+        if state in ('running', 'paused'):
+            if progress['fraction'] is None:
+                done = '{} lines'.format(progress['completed'])
+            else:
+                done = '{:.0%}'.format(progress['fraction'])
+            self.sendcode_pushButton.setText('{0} ({1}) - {2}'.format(
+                'Pause' if state == 'running' else 'Resume', state, done))
+        elif state != self.program_state:
+            self.sendcode_pushButton.setText(self.sendcode_text)
+            report = 'Program {0}: {1} commands'.format(state, progress['completed'])
+            if progress['error']:
+                report += ', ' + progress['error']
+            self.returncode_textBrowser.append(report)
+        self.program_state = state
 
     def rectmode_pushButton_clicked(self):
         """
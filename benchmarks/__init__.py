@@ -0,0 +1,5 @@
+"""
+Benchmarks for the SANXI robot control stack, run from the repository root:
+    python -m benchmarks.<module_name>
+Author: Mr SoSimple
+"""
@@ -0,0 +1,68 @@
+"""
+Window size tuning of command_pipeline.CommandPipeline against sanxi_emulator.SanxiEmulator.
+For each window size a program of G00 moves is run through the pipeline; the report gives the total time,
+the robot utilization (time spent moving / total time) and the commands rejected by the controller
+(buffer overflow). The smallest window that reaches full utilization is the one to use on the robot.
+Usage: python -m benchmarks.pipeline [--moves N] [--windows 1 2 4 ...] [--latency S] [--motion-time S] [--json FILE]
+Author: Mr SoSimple
+"""
+
+import argparse
+import json
+import time
+
+from command_pipeline import CommandPipeline
+from sanxi_core import Sanxi
+from sanxi_emulator import SanxiEmulator
+
+
+def run_window(window, moves, motion_time, latency, buffer_size):
+    emulator = SanxiEmulator(rate=50, motion_time=motion_time, latency=latency, buffer_size=buffer_size)
+    port = emulator.start()
+    sanxi = Sanxi()
+    if not sanxi.connect_sanxi(port):
+        raise RuntimeError('cannot connect to emulator on {}'.format(port))
+    sanxi.start_update_sanxi_output()
+    sanxi.changeto_mode14()
+    lines = ['G00 J1={}\n'.format(i % 2 * 10 + i * 0.001) for i in range(moves)]
+    pipeline = CommandPipeline(sanxi, window=window, timeout=(window + 2) * motion_time + 1.0)
+    start = time.perf_counter()
+    pipeline.run(lines, stop_on_error=False)
+    # 最后一条命令开始执行后再等待其运动结束
+    time.sleep(motion_time)
+    elapsed = time.perf_counter() - start
+    sanxi.stop_update_sanxi_output()
+    sanxi.disconnect_sanxi()
+    emulator.stop()
+    stats = pipeline.get_stats()
+    executed = stats['completed']
+    return {'window': window,
+            'seconds': elapsed,
+            'utilization': executed * motion_time / elapsed,
+            'rejected': stats['failed'],
+            'max_in_flight': stats['max_in_flight'],
+            'wait_time': stats['wait_time']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moves', type=int, default=60, help='G00 moves per run')
+    parser.add_argument('--windows', type=int, nargs='+', default=[1, 2, 4, 8, 16, 24], help='window sizes')
+    parser.add_argument('--motion-time', type=float, default=0.02, help='emulated duration of each move (s)')
+    parser.add_argument('--latency', type=float, default=0.05, help='emulated reply latency (s)')
+    parser.add_argument('--buffer-size', type=int, default=16, help='emulated controller buffer size')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    results = []
+    print('{:>7} {:>9} {:>12} {:>9} {:>14}'.format('window', 'seconds', 'utilization', 'rejected', 'max_in_flight'))
+    for window in args.windows:
+        result = run_window(window, args.moves, args.motion_time, args.latency, args.buffer_size)
+        results.append(result)
+        print('{window:>7} {seconds:>9.3f} {utilization:>12.1%} {rejected:>9} {max_in_flight:>14}'.format(**result))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Microbenchmark of the serial receive paths in communication.RS232:
+readline-based receive() against the bulk receive_frames().
+A writer thread paces telemetry lines into a serial stand-in at the byte rate of the given baud rate
+(10 bits per byte), the reader under test drains them. The stand-in is a Linux pty by default,
+or pyserial's loop:// port (whose byte-wise queue makes the writer itself expensive).
+Usage: python -m benchmarks.serial_receive [--lines N] [--baud 115200 460800 ...] [--port pty|loop] [--json FILE]
+Author: Mr SoSimple
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from communication import RS232
+
+
+JN_LINE = b'J1=12.500 J2=-45.250 J3=90.000 J4=0.125 J5=-30.500 J6=180.000\r\n'
+XYZ_LINE = b'X=250.125 Y=-120.500 Z=310.750 A=180.000 B=0.000 C=90.000 D=0.000\r\n'
+
+
+def paced_writer(write, data, baud_rate, stopped):
+    """
+    按波特率对应的字节速率写数据，baud_rate=0 时不限速
+    """
+    bytes_per_second = baud_rate / 10
+    chunk = 256
+    start = time.perf_counter()
+    sent = 0
+    while sent < len(data) and not stopped.is_set():
+        if bytes_per_second:
+            due = start + (sent + chunk) / bytes_per_second
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sent += write(data[sent:sent + chunk])
+
+
+def read_with_receive(rs232, n_lines, deadline):
+    count = 0
+    while count < n_lines and time.perf_counter() < deadline:
+        if rs232.receive():
+            count += 1
+    return count
+
+
+def read_with_frames(rs232, n_lines, deadline):
+    count = 0
+    while count < n_lines and time.perf_counter() < deadline:
+        count += len(rs232.receive_frames())
+    return count
+
+
+def open_stand_in(port):
+    """
+    打开串口替身，返回 (端口名, 写函数, 关闭函数)
+    """
+    if port == 'loop':
+        return 'loop://', None, lambda: None
+    master, slave = os.openpty()
+    return os.ttyname(slave), lambda data: os.write(master, data), lambda: (os.close(master), os.close(slave))
+
+
+def run_case(reader, n_lines, baud_rate, port='pty', time_limit=60.0):
+    port_name, write, close = open_stand_in(port)
+    rs232 = RS232()
+    rs232.set_port(port_name)
+    rs232.set_baud_rate(baud_rate or 115200)
+    rs232.set_timeout(0.1)
+    rs232.connect()
+    if write is None:
+        # loop:// 端口写入的数据由自身读回
+        write = lambda data: rs232.send(data.decode()) or len(data)
+    data = (JN_LINE + XYZ_LINE) * (n_lines // 2)
+    stopped = threading.Event()
+    writer = threading.Thread(target=paced_writer, args=(write, data, baud_rate, stopped))
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    writer.start()
+    received = reader(rs232, n_lines // 2 * 2, wall_start + time_limit)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    stopped.set()
+    writer.join()
+    rs232.disconnect()
+    close()
+    return {'lines': received,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'lines_per_s': received / wall if wall else 0.0,
+            'cpu_us_per_line': cpu / received * 1e6 if received else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--baud', type=int, nargs='+', default=[115200, 460800, 921600, 0],
+                        help='baud rates to emulate, 0 = unpaced')
+    parser.add_argument('--port', choices=['pty', 'loop'], default='pty')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    results = []
+    for baud_rate in args.baud:
+        for name, reader in (('receive', read_with_receive), ('receive_frames', read_with_frames)):
+            result = run_case(reader, args.lines, baud_rate, args.port)
+            result.update({'reader': name, 'baud_rate': baud_rate})
+            results.append(result)
+            print('{:>8} {:<15} {:>7} lines {:>10.0f} lines/s {:>8.2f} us cpu/line'.format(
+                baud_rate or 'unpaced', name, result['lines'], result['lines_per_s'],
+                result['cpu_us_per_line'] or 0.0))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Stop latency against sanxi_emulator.SanxiEmulator while a burst of commands is queued for sending.
+A burst of G00 lines is handed to send() (as Send Code does), then the stop is requested at once:
+    queued  '\\x30' sent through the ordinary command queue, written after the whole burst
+    stop    Sanxi.stop(), written at once by the calling thread after flushing the queued burst
+The latency is the time from the stop request to the stop byte being written to the serial port.
+Usage: python -m benchmarks.stop_latency [--burst N] [--repeat N] [--json FILE]
+Author: Mr SoSimple
+"""
+
+import argparse
+import json
+import time
+
+from sanxi_core import Sanxi
+from sanxi_emulator import SanxiEmulator
+
+
+def run_once(mode, burst):
+    emulator = SanxiEmulator(rate=50, motion_time=0.02, buffer_size=16)
+    port = emulator.start()
+    sanxi = Sanxi()
+    if not sanxi.connect_sanxi(port):
+        raise RuntimeError('cannot connect to emulator on {}'.format(port))
+    sanxi.start_update_sanxi_output()
+    sanxi.changeto_mode14()
+    for i in range(burst):
+        sanxi.send('G00 J1={0:.3f} J2={1:.3f}\n'.format(i % 2 * 10 + i * 0.001, i * 0.001))
+    if mode == 'queued':
+        start = time.perf_counter()
+        sanxi.send('\x30')
+        sanxi.flush_send()  # \x30 排在最后，队列写完即已写出
+        latency = time.perf_counter() - start
+        flushed = 0
+    else:
+        sanxi.stop()
+        stats = sanxi.get_send_stats()
+        latency = stats['stop_last_latency']
+        flushed = stats['flushed']
+    sanxi.flush_send()
+    sanxi.stop_update_sanxi_output()
+    sanxi.disconnect_sanxi()
+    emulator.stop()
+    return latency, flushed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--burst', type=int, default=2000, help='G00 lines queued before the stop')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per mode')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    results = []
+    print('{:>7} {:>10} {:>10} {:>9}'.format('mode', 'mean_ms', 'max_ms', 'flushed'))
+    for mode in ('queued', 'stop'):
+        runs = [run_once(mode, args.burst) for _ in range(args.repeat)]
+        latencies = [latency for latency, _ in runs]
+        result = {'mode': mode,
+                  'mean_ms': sum(latencies) / len(latencies) * 1e3,
+                  'max_ms': max(latencies) * 1e3,
+                  'flushed': sum(flushed for _, flushed in runs) / len(runs)}
+        results.append(result)
+        print('{mode:>7} {mean_ms:>10.3f} {max_ms:>10.3f} {flushed:>9.0f}'.format(**result))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
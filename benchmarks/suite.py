@@ -0,0 +1,268 @@
+"""
+Benchmark suite of the SANXI control stack against sanxi_emulator.SanxiEmulator.
+Sections:   command_latency     round trip of each Sanxi public method, from the call until its reply
+                                (echo or state byte) has been processed by Sanxi
+            parse_throughput    lines/s through Sanxi's telemetry parsing path
+            display_latency     serial arrival to Sanxi_window.display_board update (needs PyQt5)
+            idle_threads        thread count, thread creations and CPU use while telemetry is streaming
+Results are written as JSON so they can be compared between versions.
+Usage: python -m benchmarks.suite [--output FILE] [--repeat N] [--rate HZ]
+Author: Mr SoSimple
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from sanxi_core import Sanxi
+from sanxi_emulator import SanxiEmulator
+
+
+class InstrumentedSanxi(Sanxi):
+    """
+    记录每条消息被 Sanxi 处理的时刻
+    """
+    def __init__(self):
+        super(InstrumentedSanxi, self).__init__()
+        self.processed = []  # (处理时刻, Message)
+        self.processed_condition = threading.Condition()
+
+    def wait_message(self, timeout=None):
+        message = super(InstrumentedSanxi, self).wait_message(timeout)
+        if message is not None:
+            with self.processed_condition:
+                self.processed.append((time.time(), message))
+                self.processed_condition.notify_all()
+        return message
+
+    def wait_processed(self, predicate, since, timeout=2.0):
+        """
+        等待第 since 条之后满足 predicate 的消息被处理
+        :return: 处理时刻，超时返回 None
+        """
+        deadline = time.time() + timeout
+        index = since
+        with self.processed_condition:
+            while True:
+                while index < len(self.processed):
+                    processed_time, message = self.processed[index]
+                    index += 1
+                    if predicate(message.data):
+                        return processed_time
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.processed_condition.wait(remaining)
+
+
+def summarize(samples):
+    """
+    :param samples: list of float (s)
+    :return: dict, 单位 ms
+    """
+    if not samples:
+        return {'n': 0}
+    ordered = sorted(samples)
+    n = len(ordered)
+    return {'n': n,
+            'mean_ms': sum(ordered) / n * 1e3,
+            'p50_ms': ordered[n // 2] * 1e3,
+            'p95_ms': ordered[min(n - 1, int(n * 0.95))] * 1e3,
+            'max_ms': ordered[-1] * 1e3}
+
+
+def connect_emulator(sanxi_class, rate):
+    emulator = SanxiEmulator(rate=rate, motion_time=0.02, homing_time=0.2)
+    port = emulator.start()
+    sanxi = sanxi_class()
+    if not sanxi.connect_sanxi(port):
+        raise RuntimeError('cannot connect to emulator on {}'.format(port))
+    sanxi.start_update_sanxi_output()
+    return emulator, sanxi
+
+
+def disconnect_emulator(emulator, sanxi):
+    sanxi.stop_update_sanxi_output()
+    sanxi.disconnect_sanxi()
+    emulator.stop()
+
+
+##############################sections##############################
+def bench_command_latency(repeat, rate):
+    emulator, sanxi = connect_emulator(InstrumentedSanxi, rate)
+    axes = {'X': '', 'Y': '', 'Z': '', 'A': '', 'B': '', 'C': '', 'D': ''}
+    joints = {'J1': '', 'J2': '', 'J3': '', 'J4': '', 'J5': '', 'J6': ''}
+    cases = [
+        ('set_motion_para', lambda i: sanxi.set_motion_para(40 + i % 2 * 10, 50, 50),
+         lambda line: line.startswith('G07 VE')),
+        ('rect_move', lambda i: sanxi.rect_move('line', **dict(axes, X=200 + i % 10)),
+         lambda line: line.startswith('G21')),
+        ('multi_joints_motion', lambda i: sanxi.multi_joints_motion(**dict(joints, J1=i % 10)),
+         lambda line: line.startswith('G00')),
+        ('single_joint_motion_start', lambda i: sanxi.single_joint_motion_start(1, True),
+         lambda line: line.startswith('J1')),
+        ('stop', lambda i: sanxi.stop(),
+         lambda line: line.startswith('\x10')),
+    ]
+    results = {}
+    for name, call, predicate in cases:
+        call_times = []
+        round_trips = []
+        for i in range(repeat):
+            since = len(sanxi.processed)
+            start = time.time()
+            call(i)
+            returned = time.time()
+            done = sanxi.wait_processed(predicate, since)
+            call_times.append(returned - start)
+            if done is not None:
+                round_trips.append(done - start)
+            if name == 'single_joint_motion_start':
+                sanxi.single_joint_motion_stop(1)
+            time.sleep(0.03)
+        results[name] = {'call': summarize(call_times),
+                         'round_trip': summarize(round_trips),
+                         'timeouts': repeat - len(round_trips)}
+    disconnect_emulator(emulator, sanxi)
+    return results
+
+
+def parse_lines(sanxi, lines):
+    """
+    将 lines 直接送入 Sanxi 的消息解析路径
+    """
+    put_message = sanxi._Message_control__put_message
+    extract_output_info = sanxi._Sanxi__extract_output_info
+    for line in lines:
+        put_message(line)
+    for message in sanxi.get_messages():
+        extract_output_info(message)
+
+
+def bench_parse_throughput(n_lines):
+    sanxi = Sanxi()
+    sanxi.set_queue_size(n_lines)
+    lines = []
+    for i in range(n_lines // 2):
+        lines.append('J1={0:.3f} J2=-45.250 J3=90.000 J4=0.125 J5=-30.500 J6=180.000\r\n'.format(i * 0.001).encode())
+        lines.append('X={0:.3f} Y=-120.500 Z=310.750 A=180.000 B=0.000 C=90.000 D=0.000\r\n'.format(i * 0.001).encode())
+    start = time.perf_counter()
+    parse_lines(sanxi, lines)
+    elapsed = time.perf_counter() - start
+    return {'lines': len(lines), 'seconds': elapsed, 'lines_per_s': len(lines) / elapsed}
+
+
+def bench_display_latency(rate, duration):
+    try:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtCore import QTimer
+        from PyQt5.QtWidgets import QApplication
+        from SanxiUI_function import Sanxi_window
+    except ImportError as e:
+        return {'skipped': str(e)}
+    app = QApplication.instance() or QApplication(sys.argv)
+    emulator = SanxiEmulator(rate=rate, motion_time=duration, homing_time=0.2)
+    port = emulator.start()
+    window = Sanxi_window()
+    window.connect_sanxi(port)
+    window.start_update_sanxi_output()
+    # 记录 X 显示值的每次变化
+    shown = []
+    set_text = window.xshow_lineEdit.setText
+    window.xshow_lineEdit.setText = lambda text: (shown.append((time.time(), text)), set_text(text))
+    arrivals = {}
+    wait_message = window.wait_message
+
+    def record_arrivals(timeout=None):
+        message = wait_message(timeout)
+        if message is not None and message.raw.startswith(b'X='):
+            arrivals.setdefault(message.data.split()[0][2:], message.timestamp)
+        return message
+    window.wait_message = record_arrivals
+    window.rect_move('line', X=500, Y='', Z='', A='', B='', C='', D='')
+    # display_board 由 GUI 线程中的 QTimer 驱动
+    QTimer.singleShot(int((duration + 0.2) * 1000), app.quit)
+    app.exec_()
+    window.display_board_timer.stop()
+    window.stop_update_sanxi_output()
+    window.disconnect_sanxi()
+    emulator.stop()
+    delays = [shown_time - arrivals[text] for shown_time, text in shown if text in arrivals]
+    del app
+    return {'updates': len(shown), 'delay': summarize(delays)}
+
+
+def bench_idle_threads(rate, duration):
+    emulator, sanxi = connect_emulator(Sanxi, rate)
+    sanxi.set_return_data_mode('joint space')
+    sanxi.changeto_mode14()
+    time.sleep(0.2)
+    # 统计窗口内新建线程数
+    started = [0]
+    thread_start = threading.Thread.start
+
+    def counting_start(thread):
+        started[0] += 1
+        thread_start(thread)
+    threading.Thread.start = counting_start
+    counts = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        while time.perf_counter() - wall_start < duration:
+            counts.append(threading.active_count())
+            time.sleep(0.01)
+    finally:
+        threading.Thread.start = thread_start
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    disconnect_emulator(emulator, sanxi)
+    return {'seconds': wall,
+            'threads_started_per_s': started[0] / wall,
+            'active_threads_mean': sum(counts) / len(counts),
+            'active_threads_max': max(counts),
+            'cpu_percent': cpu / wall * 100,
+            'note': 'CPU includes the in-process emulator'}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='bench_output.json', help='JSON result file')
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions per command')
+    parser.add_argument('--rate', type=float, default=100.0, help='emulator telemetry rate (Hz)')
+    parser.add_argument('--lines', type=int, default=100000, help='lines for the parse benchmark')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds for the idle and display benchmarks')
+    args = parser.parse_args()
+    report = {'revision': git_revision(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'config': vars(args),
+              'results': {}}
+    sections = [('command_latency', lambda: bench_command_latency(args.repeat, args.rate)),
+                ('parse_throughput', lambda: bench_parse_throughput(args.lines)),
+                ('display_latency', lambda: bench_display_latency(args.rate, args.duration)),
+                ('idle_threads', lambda: bench_idle_threads(args.rate, args.duration))]
+    for name, section in sections:
+        print('running', name)
+        report['results'][name] = section()
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(json.dumps(report['results'], indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Throughput of telemetry.parse_frame() against the regex path it replaced in Sanxi.__extract_output_info
+(decode, then the three '.*'-prefixed regexes, values kept as strings).
+The corpus is either synthetic telemetry or a recorded file with one received line per line.
+Usage: python -m benchmarks.telemetry_parse [--lines N] [--corpus FILE] [--json FILE]
+Author: Mr SoSimple
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+
+import telemetry
+
+
+G_DETECT_PATTERN = re.compile(r'.*G.*')
+JN_PATTERN = re.compile(r'.*J1=(.*) J2=(.*) J3=(.*) J4=(.*) J5=(.*) J6=(.*)[\r\s]')
+XYZ_PATTERN = re.compile(r'.*X=(.*) Y=(.*) Z=(.*) A=(.*) B=(.*) C=(.*) D=(.*)[\r\s]')
+
+
+def synthetic_corpus(n_lines, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n_lines):
+        kind = rng.random()
+        if kind < 0.45:
+            lines.append('J1={:.3f} J2={:.3f} J3={:.3f} J4={:.3f} J5={:.3f} J6={:.3f}\r\n'.format(
+                *[rng.uniform(-180, 180) for _ in range(6)]).encode())
+        elif kind < 0.9:
+            lines.append('X={:.3f} Y={:.3f} Z={:.3f} A={:.3f} B={:.3f} C={:.3f} D=0.000\r\n'.format(
+                *[rng.uniform(-500, 500) for _ in range(6)]).encode())
+        elif kind < 0.95:
+            lines.append('G00 J1={:.1f} J2={:.1f}\r\n'.format(rng.uniform(-90, 90), rng.uniform(-90, 90)).encode())
+        else:
+            lines.append(rng.choice([b'\x10', b'\x14', b'\x30']))
+    return lines
+
+
+def regex_path(lines):
+    poses = 0
+    for raw in lines:
+        line = raw.decode()
+        jn_match = JN_PATTERN.match(line)
+        xyz_match = XYZ_PATTERN.match(line)
+        G_match = G_DETECT_PATTERN.match(line)
+        if G_match is None:
+            if jn_match:
+                jn_value = [jn_match.group(i) for i in range(1, 7)]
+                poses += 1
+            if xyz_match:
+                xyz_value = [xyz_match.group(i) for i in range(1, 8)]
+                poses += 1
+    return poses
+
+
+def parser_path(lines):
+    poses = 0
+    parse_frame = telemetry.parse_frame
+    pose_types = (telemetry.JointPose, telemetry.CartesianPose)
+    for raw in lines:
+        for event in parse_frame(raw):
+            if type(event) in pose_types:
+                poses += 1
+    return poses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=200000, help='synthetic corpus size')
+    parser.add_argument('--corpus', help='recorded lines, one per line')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    if args.corpus:
+        with open(args.corpus, 'rb') as f:
+            lines = f.read().splitlines(True)
+    else:
+        lines = synthetic_corpus(args.lines)
+    results = {'lines': len(lines)}
+    for name, path in (('regex', regex_path), ('parse_frame', parser_path)):
+        start = time.perf_counter()
+        poses = path(lines)
+        elapsed = time.perf_counter() - start
+        results[name] = {'seconds': elapsed, 'lines_per_s': len(lines) / elapsed, 'poses': poses}
+        print('{:<12} {:>10.0f} lines/s  {} poses'.format(name, len(lines) / elapsed, poses))
+    results['speedup'] = results['regex']['seconds'] / results['parse_frame']['seconds']
+    print('speedup {:.1f}x'.format(results['speedup']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+This module includes a pipeline that keeps a bounded number of G-code commands in flight on the SANXI controller.
+A command is in flight from the moment it is written until the controller echoes it (a buffered motion command
+is echoed when it starts executing) or rejects it with 'ERR ...'. A new command is only released when a
+completion frees a slot of the window, so the controller's motion buffer is kept full but never overrun.
+Class: CommandPipeline      submit() run() drain() cancel() get_stats()
+Author: Mr SoSimple
+"""
+
+import threading
+import time
+
+
+COMMAND_TIMEOUT = 60.0  # 默认每条命令等待回送的超时(s)，控制器不回送时释放窗口空位而不是永远阻塞
+
+
+class CommandPipeline(object):
+    def __init__(self, sanxi, window=4, timeout=COMMAND_TIMEOUT):
+        """
+        :param sanxi: 已连接并已 start_update_sanxi_output() 的 sanxi_core.Sanxi
+        :param window: 同时在途的最大命令数，应不大于控制器运动命令缓冲区容量
+        :param timeout: 每条命令等待回送的超时(s)，超时的命令以 TimeoutError 计为失败并释放空位；
+                        缓冲的运动命令在开始执行时才回送，超时应大于 window 条运动的耗时
+        """
+        super(CommandPipeline, self).__init__()
+        self.sanxi = sanxi
+        self.window = window
+        self.timeout = timeout
+        self.__condition = threading.Condition()
+        self.__in_flight = 0
+        self.__sent = 0
+        self.__completed = 0
+        self.__failed = 0
+        self.__cancelled = 0
+        self.__max_in_flight = 0
+        self.__wait_time = 0.0  # 因窗口已满而等待的累计时间
+        self.__errors = []  # (命令, 异常)
+        self.__futures = set()  # 在途命令的 Future
+
+    def set_window(self, window):
+        with self.__condition:
+            self.window = window
+            self.__condition.notify_all()
+
+    def submit(self, send_data, timeout=None):
+        """
+        窗口有空位时发送一条命令，否则阻塞等待
+        :param send_data: string，一行命令
+        :param timeout: 等待空位的超时(s)，None 为一直等待
+        :return: concurrent.futures.Future，同 Sanxi.send_command()；等待空位超时返回 None
+        """
+        start = time.perf_counter()
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__in_flight < self.window, timeout):
+                return None
+            self.__in_flight += 1
+            self.__sent += 1
+            self.__max_in_flight = max(self.__max_in_flight, self.__in_flight)
+            self.__wait_time += time.perf_counter() - start
+        future = self.sanxi.send_command(send_data, self.timeout)
+        with self.__condition:
+            self.__futures.add(future)
+        future.add_done_callback(lambda f: self.__on_done(send_data, f))
+        return future
+
+    def __on_done(self, send_data, future):
+        # 在 Sanxi 解析线程中调用，释放一个窗口空位
+        error = None if future.cancelled() else future.exception()
+        with self.__condition:
+            self.__in_flight -= 1
+            self.__futures.discard(future)
+            if future.cancelled():
+                self.__cancelled += 1
+            elif error is None:
+                self.__completed += 1
+            else:
+                self.__failed += 1
+                self.__errors.append((send_data.strip(), error))
+            self.__condition.notify_all()
+
+    def run(self, lines, stop_on_error=True):
+        """
+        依次发送全部命令并等待全部完成，空行被跳过
+        :param lines: 命令行的可迭代对象
+        :param stop_on_error: True-有命令被拒绝后不再发送
+        :return: bool, 全部命令均被回送返回 True
+        """
+        self.sanxi.changeto_mode14()
+        for line in lines:
+            if not line.strip():
+                continue
+            if stop_on_error and self.__failed:
+                break
+            self.submit(line if line.endswith('\n') else line + '\n')
+        self.drain()
+        return not self.__failed
+
+    def drain(self, timeout=None):
+        """
+        等待在途命令全部完成
+        :return: bool, 超时返回 False
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__in_flight == 0, timeout)
+
+    def cancel(self):
+        """
+        放弃全部在途命令，用于控制器缓冲区已被清空(如 \x30 中止)之后，这些命令不会再回送
+        """
+        with self.__condition:
+            futures = list(self.__futures)
+        for future in futures:
+            future.cancel()
+
+    @property
+    def in_flight(self):
+        return self.__in_flight
+
+    def get_errors(self):
+        """
+        :return: list of (命令, 异常)
+        """
+        with self.__condition:
+            return list(self.__errors)
+
+    def get_stats(self):
+        """
+        :return: dict，sent/completed/failed/cancelled 命令数，max_in_flight 最大在途数，wait_time 等待空位的累计时间(s)
+        """
+        with self.__condition:
+            return {'window': self.window,
+                    'sent': self.__sent,
+                    'completed': self.__completed,
+                    'failed': self.__failed,
+                    'cancelled': self.__cancelled,
+                    'in_flight': self.__in_flight,
+                    'max_in_flight': self.__max_in_flight,
+                    'wait_time': self.__wait_time}
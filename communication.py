@@ -1,16 +1,36 @@
 """
 This communication module includes RS232 communicating with SANXI robot
-Class: RS232 provides fundamental serial operations, including connect, disconnect, send and receive messages
+Class: RS232 provides fundamental serial operations, including connect, disconnect, send and receive messages,
+         all writes go through a single writer thread that coalesces queued commands, served by priority lanes:
+         PRIORITY_STOP data flushes the queued commands and is written at once by the calling thread,
+         PRIORITY_QUERY data (state queries) is written ahead of the queued PRIORITY_COMMAND data
        Message_control provides high level serial and message operations, including a thread  to monitor the message
          received from the serial, and other message handling methods such as changing to hex or ASCII.
-Functions: RS232  connect() disconnect() send() receive()
-           Message_control  start_refresh() stop_refresh()
+Functions: RS232  connect() disconnect() send() send_stop() receive() receive_frames() flush_send() get_send_stats()
+           Message_control  start_refresh() stop_refresh() get_messages() wait_message()
 Author: Mr SoSimple
 """
 
 import serial
 import time
 import threading
+from collections import deque, namedtuple
+
+
+PRIORITY_STOP = 0  # 急停/停止：清空排队的命令，由调用线程立即写出
+PRIORITY_QUERY = 1  # 状态查询：排在已排队的命令之前
+PRIORITY_COMMAND = 2  # 运动、参数与模式切换命令，按发送顺序写出
+
+
+class Message(namedtuple('Message', ['seq', 'timestamp', 'raw'])):
+    """
+    接收队列中的一条消息：序号、接收时间戳、原始字节，按需解码
+    """
+    __slots__ = ()
+
+    @property
+    def data(self):
+        return self.raw.decode(errors='replace')
 
 
 class RS232(object):
@@ -21,6 +41,24 @@ class RS232(object):
         # 串口状态机
         self.__connect_state = False  # 串口打开状态
         self.__ser = serial.Serial()
+        # 批量接收缓冲区，复用同一块内存，帧以 memoryview 切片返回
+        self.__rx_buffer = bytearray(4096)
+        self.__rx_view = memoryview(self.__rx_buffer)
+        self.__rx_start = 0  # 未成帧数据起点
+        self.__rx_end = 0  # 有效数据终点
+        self.__frame_codes = b''  # 出现在帧首时单独成帧的字节
+        # 发送线程：send() 只把编码后的字节放入对应优先级的队列，由发送线程按优先级把排队的连续命令合并为一次写入
+        self.__tx_lanes = (None, deque(), deque())  # 下标为优先级，PRIORITY_STOP 不排队
+        self.__tx_condition = threading.Condition()
+        self.__tx_pending = 0  # 已排队未写完的数据数
+        self.__tx_stopping = False
+        self.__tx_stop_waiting = 0  # 等待写入锁的停止命令数，发送线程让路
+        self.__tx_write_lock = threading.Lock()  # 串口写入互斥，停止命令不会插入一次写入的中间
+        self.__tx_thread = None
+        self.__tx_max_chunk = 4096  # 单次合并写入的最大字节数
+        self.__tx_stats = {'commands': 0, 'writes': 0, 'bytes': 0,
+                           'last_latency': 0.0, 'max_latency': 0.0, 'total_latency': 0.0,
+                           'stops': 0, 'flushed': 0, 'stop_last_latency': 0.0, 'stop_max_latency': 0.0}
 
     def set_port(self, port_name):
         self.__portname = port_name
@@ -31,9 +69,19 @@ class RS232(object):
     def set_timeout(self, timeout):
         self.__timeout = timeout
 
+    def set_frame_codes(self, frame_codes):
+        """
+        设置单字节帧代码：出现在帧首时不等换行符，立即单独成帧
+        :param frame_codes: bytes
+        """
+        self.__frame_codes = frame_codes
+
     def connect(self):
         try:
             # 设置端口、波特率、接收超时
+            if '://' in self.__portname:
+                # URL 形式的端口，如 loop://、socket://host:port，用于测试与仿真
+                self.__ser = serial.serial_for_url(self.__portname, do_not_open=True)
             self.__ser.port = self.__portname
             self.__ser.baudrate = self.__baud_rate
             self.__ser.timeout = self.__timeout
@@ -43,6 +91,7 @@ class RS232(object):
         else:
             if self.__ser.isOpen():
                 self.__connect_state = True
+                self.__start_writer()
                 return True
             else:
                 self.__connect_state = False
@@ -55,6 +104,7 @@ class RS232(object):
             return False
 
     def disconnect(self):
+        self.__stop_writer()
         try:
             self.__ser.close()
         except Exception as e:
@@ -67,12 +117,151 @@ class RS232(object):
                 self.__connect_state = False
                 return True
 
-    def send(self, send_data):
+    def send(self, send_data, priority=PRIORITY_COMMAND):
+        """
+        发送数据：发送线程运行时放入发送队列后立即返回，否则直接写串口
+        :param send_data: string 或 bytes
+        :param priority: PRIORITY_COMMAND / PRIORITY_QUERY / PRIORITY_STOP，PRIORITY_STOP 同 send_stop()
+        :return: None
+        """
+        if priority == PRIORITY_STOP:
+            self.send_stop(send_data)
+            return
+        if isinstance(send_data, str):
+            send_data = send_data.encode()
+        if self.__tx_thread is not None:
+            with self.__tx_condition:
+                self.__tx_lanes[priority].append((time.perf_counter(), send_data))
+                self.__tx_pending += 1
+                self.__tx_condition.notify_all()
+        else:
+            self.__write(send_data)
+
+    def send_stop(self, send_data, flush=True):
+        """
+        立即发送停止类命令：不排队，清空排队的命令后由调用线程写入串口
+        :param send_data: string 或 bytes，如 '\x30'
+        :param flush: True-丢弃排队未写出的 PRIORITY_COMMAND 数据
+        :return: int，丢弃的排队命令数
+        """
+        start = time.perf_counter()
+        if isinstance(send_data, str):
+            send_data = send_data.encode()
+        # 持有写入锁时清空队列并写出：发送线程只在持有写入锁时取出数据，取出的数据已在停止命令之前写完
+        with self.__tx_condition:
+            self.__tx_stop_waiting += 1
+        with self.__tx_write_lock:
+            flushed = 0
+            if flush:
+                with self.__tx_condition:
+                    lane = self.__tx_lanes[PRIORITY_COMMAND]
+                    flushed = len(lane)
+                    lane.clear()
+                    self.__tx_pending -= flushed
+                    self.__tx_condition.notify_all()
+            self.__write(send_data)
+        with self.__tx_condition:
+            self.__tx_stop_waiting -= 1
+            self.__tx_condition.notify_all()
+        latency = time.perf_counter() - start
+        stats = self.__tx_stats
+        stats['stops'] += 1
+        stats['flushed'] += flushed
+        stats['stop_last_latency'] = latency
+        stats['stop_max_latency'] = max(stats['stop_max_latency'], latency)
+        return flushed
+
+    def __write(self, data):
         try:
-            self.__ser.write(send_data.encode())
+            self.__ser.write(data)
         except Exception as e:
             print('Send data error: ', e)
 
+    def __start_writer(self):
+        if self.__tx_thread is None:
+            self.__tx_stopping = False
+            self.__tx_thread = threading.Thread(target=self.__thread_func_write,
+                                                name='thread_func_write')
+            self.__tx_thread.daemon = True
+            self.__tx_thread.start()
+
+    def __stop_writer(self):
+        if self.__tx_thread is not None:
+            with self.__tx_condition:
+                self.__tx_stopping = True  # 停止标志，之前排队的数据仍会写出
+                self.__tx_condition.notify_all()
+            self.__tx_thread.join()
+            self.__tx_thread = None
+
+    def __next_chunk(self):
+        """
+        取最高优先级的非空队列中排队的连续命令，合并不超过 __tx_max_chunk 字节；须持有写入锁
+        :return: (enqueue_times, chunks)，队列为空(如已被 send_stop() 清空)时返回 None
+        """
+        with self.__tx_condition:
+            lane = self.__tx_lanes[PRIORITY_QUERY] or self.__tx_lanes[PRIORITY_COMMAND]
+            if not lane:
+                return None
+            enqueue_times = []
+            chunks = []
+            size = 0
+            while lane and size < self.__tx_max_chunk:
+                enqueue_time, data = lane.popleft()
+                enqueue_times.append(enqueue_time)
+                chunks.append(data)
+                size += len(data)
+            return enqueue_times, chunks
+
+    def __thread_func_write(self):
+        while True:
+            with self.__tx_condition:
+                # 有停止命令等待写入锁时不再取锁，避免其一直抢不到
+                while not any(self.__tx_lanes[1:]) or self.__tx_stop_waiting:
+                    if self.__tx_stopping and not any(self.__tx_lanes[1:]):
+                        return
+                    self.__tx_condition.wait()
+            # 取出与写入都在写入锁内，send_stop() 不会插在取出的数据之前
+            with self.__tx_write_lock:
+                item = self.__next_chunk()
+                if item is None:
+                    continue
+                enqueue_times, chunks = item
+                data = b''.join(chunks)
+                self.__write(data)
+            latency = time.perf_counter() - enqueue_times[0]
+            stats = self.__tx_stats
+            stats['commands'] += len(chunks)
+            stats['writes'] += 1
+            stats['bytes'] += len(data)
+            stats['last_latency'] = latency
+            stats['max_latency'] = max(stats['max_latency'], latency)
+            stats['total_latency'] += latency
+            with self.__tx_condition:
+                self.__tx_pending -= len(chunks)
+                self.__tx_condition.notify_all()
+
+    def flush_send(self):
+        """
+        阻塞直到发送队列中的数据全部写入串口
+        :return: None
+        """
+        if self.__tx_thread is not None:
+            with self.__tx_condition:
+                self.__tx_condition.wait_for(lambda: self.__tx_pending <= 0)
+
+    def get_send_stats(self):
+        """
+        发送统计：队列深度、命令数、写入次数、字节数、写入延迟(s，从入队到写完，按每次写入中最早的命令计)，
+        停止命令数、被其清空的排队命令数、停止延迟(s，从调用 send_stop() 到写入串口)
+        :return: dict
+        """
+        stats = dict(self.__tx_stats)
+        with self.__tx_condition:
+            stats['queue_depth'] = sum(len(lane) for lane in self.__tx_lanes[1:])
+        stats['mean_latency'] = stats['total_latency'] / stats['writes'] if stats['writes'] else 0.0
+        del stats['total_latency']
+        return stats
+
     def receive(self):
         try:
             receive_data = self.__ser.readline().decode()
@@ -80,18 +269,115 @@ class RS232(object):
         except Exception as e:
             print('Receive data error: ', e)
 
+    def receive_frames(self):
+        """
+        批量读取串口缓存中的全部数据，按换行符切分为帧，不解码
+        帧是接收缓冲区上的 memoryview 切片，只在下一次调用前有效，需保留时用 bytes() 复制
+        超时无新数据时，残余的不完整帧单独成帧，与 readline() 超时行为一致；
+        帧首的单字节帧代码(见 set_frame_codes)立即单独成帧
+        :return: list of memoryview
+        """
+        try:
+            buffer = self.__rx_buffer
+            view = self.__rx_view
+            # 将上次未成帧的数据移到缓冲区开头
+            remain = self.__rx_end - self.__rx_start
+            if remain and self.__rx_start:
+                buffer[:remain] = buffer[self.__rx_start:self.__rx_end]
+            self.__rx_start = 0
+            self.__rx_end = end = remain
+            waiting = self.__ser.in_waiting
+            if not waiting:
+                # 串口缓存为空时阻塞等待第一个字节，最长 timeout
+                end += self.__ser.readinto(view[end:end + 1])
+                waiting = self.__ser.in_waiting if end > remain else 0
+            if waiting:
+                end += self.__ser.readinto(view[end:min(end + waiting, len(buffer))])
+        except Exception as e:
+            print('Receive data error: ', e)
+            return []
+        frames = []
+        start = 0
+        codes = self.__frame_codes
+        while start < end:
+            if buffer[start] in codes:
+                # 帧首的单字节代码(如状态字节)立即单独成帧
+                frames.append(view[start:start + 1])
+                start += 1
+                continue
+            index = buffer.find(b'\n', start, end)
+            if index < 0:
+                break
+            frames.append(view[start:index + 1])
+            start = index + 1
+        if start < end and (end == remain or (start == 0 and end == len(buffer))):
+            # 超时无新数据，或缓冲区已满仍无换行符
+            frames.append(view[start:end])
+            start = end
+        self.__rx_start = start
+        self.__rx_end = end
+        return frames
+
 
 class Message_control(RS232):
     def __init__(self):
         super().__init__()
         self.__stopped = False
-        self.message = ''
+        self.t = None  # 串口接收线程
+        self.__last_raw = b''  # 最近一条消息的原始字节
+        # 有界接收队列：按序号保存每一行消息，满时丢弃最旧的并计数
+        self.__queue_size = 1024
+        self.__message_queue = deque()
+        self.__message_condition = threading.Condition()
+        self.message_seq = 0  # 已接收消息总数，即最新消息的序号
+        self.overflow_count = 0  # 因队列满而丢弃的消息数
+
+    @property
+    def message(self):
+        """
+        最近一条消息
+        """
+        return self.__last_raw.decode(errors='replace')
+
+    def set_queue_size(self, queue_size):
+        self.__queue_size = queue_size
+
+    def __put_message(self, raw):
+        with self.__message_condition:
+            self.message_seq += 1
+            if len(self.__message_queue) >= self.__queue_size:
+                self.__message_queue.popleft()
+                self.overflow_count += 1
+            self.__message_queue.append(Message(self.message_seq, time.time(), raw))
+            self.__last_raw = raw
+            self.__message_condition.notify_all()
+
+    def get_messages(self):
+        """
+        取出接收队列中的全部消息
+        :return: list of Message，按序号递增
+        """
+        with self.__message_condition:
+            messages = list(self.__message_queue)
+            self.__message_queue.clear()
+        return messages
+
+    def wait_message(self, timeout=None):
+        """
+        取出接收队列中最旧的一条消息，队列为空时阻塞等待
+        :param timeout: 最长等待时间(s)，None 为一直等待
+        :return: Message，超时或停止刷新时返回 None
+        """
+        with self.__message_condition:
+            self.__message_condition.wait_for(lambda: self.__message_queue or self.__stopped, timeout)
+            if self.__message_queue:
+                return self.__message_queue.popleft()
+            return None
 
     def __thread_func_refresh(self):
         while not self.__stopped:
-            temp = self.receive()
-            if temp:
-                self.message = temp
+            for frame in self.receive_frames():
+                self.__put_message(bytes(frame))
 
     def start_refresh(self):
         self.__stopped = False
@@ -101,3 +387,8 @@ class Message_control(RS232):
 
     def stop_refresh(self):
         self.__stopped = True
+        with self.__message_condition:
+            self.__message_condition.notify_all()
+        if self.t is not None and self.t is not threading.current_thread():
+            self.t.join()
+        self.t = None
@@ -0,0 +1,143 @@
+"""
+This module includes a small publish/subscribe bus, used by sanxi_core.Sanxi to hand telemetry to its consumers
+without extra polling threads: values are delivered in the publishing thread.
+Class: EventBus     subscribe() unsubscribe() publish() flush()
+       Subscription a subscriber with its own rate limit and coalescing, either with a callback, or as a mailbox
+                    that is drained with poll()
+Author: Mr SoSimple
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class Subscription(object):
+    def __init__(self, topic, callback=None, min_interval=0.0, coalesce=False, maxlen=1024):
+        """
+        :param topic: string，订阅的主题
+        :param callback: 回调函数 callback(value)，在发布线程中调用；为 None 时数据存入信箱，由 poll() 取出
+        :param min_interval: 最小投递间隔(s)，0 为不限速
+        :param coalesce: True-限速期间只保留最新值，到期后投递；False-限速期间的数据直接丢弃
+        :param maxlen: 信箱容量，满时丢弃最旧的数据
+        """
+        super(Subscription, self).__init__()
+        self.topic = topic
+        self.callback = callback
+        self.min_interval = min_interval
+        self.coalesce = coalesce
+        self.delivered = 0  # 已投递数
+        self.dropped = 0  # 因限速、合并或信箱满而未投递的数据数
+        self.__mailbox = deque(maxlen=1 if coalesce else maxlen)
+        self.__lock = threading.Lock()
+        self.__last_delivery = None
+        self.__pending = None  # 待投递的最新值 (value,)
+
+    def offer(self, value, now):
+        """
+        发布线程调用：投递或暂存一个值
+        """
+        if self.__last_delivery is None or now - self.__last_delivery >= self.min_interval:
+            if self.__pending is not None:
+                self.dropped += 1
+                self.__pending = None
+            self.__deliver(value, now)
+        elif self.coalesce:
+            if self.__pending is not None:
+                self.dropped += 1
+            self.__pending = (value,)
+        else:
+            self.dropped += 1
+
+    def due(self):
+        """
+        暂存值的投递时刻，无暂存值时为 None
+        """
+        if self.__pending is None:
+            return None
+        return self.__last_delivery + self.min_interval
+
+    def flush(self, now):
+        """
+        投递已到期的暂存值
+        """
+        if self.__pending is not None and now - self.__last_delivery >= self.min_interval:
+            value = self.__pending[0]
+            self.__pending = None
+            self.__deliver(value, now)
+
+    def __deliver(self, value, now):
+        self.__last_delivery = now
+        self.delivered += 1
+        if self.callback is not None:
+            try:
+                self.callback(value)
+            except Exception as e:
+                print('Subscriber error: ', e)
+        else:
+            with self.__lock:
+                if len(self.__mailbox) == self.__mailbox.maxlen:
+                    self.dropped += 1
+                self.__mailbox.append(value)
+
+    def poll(self):
+        """
+        取出信箱中的全部数据
+        :return: list
+        """
+        with self.__lock:
+            values = list(self.__mailbox)
+            self.__mailbox.clear()
+        return values
+
+
+class EventBus(object):
+    def __init__(self):
+        super(EventBus, self).__init__()
+        self.__subscriptions = {}  # topic -> tuple of Subscription，整体替换，发布时无需加锁
+        self.__lock = threading.Lock()
+
+    def subscribe(self, topic, callback=None, min_interval=0.0, coalesce=False, maxlen=1024):
+        """
+        订阅主题，参数见 Subscription
+        :return: Subscription
+        """
+        subscription = Subscription(topic, callback, min_interval, coalesce, maxlen)
+        with self.__lock:
+            self.__subscriptions[topic] = self.__subscriptions.get(topic, ()) + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.__lock:
+            subscriptions = self.__subscriptions.get(subscription.topic, ())
+            self.__subscriptions[subscription.topic] = tuple(s for s in subscriptions if s is not subscription)
+
+    def has_subscribers(self, topic):
+        return bool(self.__subscriptions.get(topic))
+
+    def publish(self, topic, value, now=None):
+        """
+        向主题的全部订阅者发布一个值
+        """
+        subscriptions = self.__subscriptions.get(topic)
+        if subscriptions:
+            if now is None:
+                now = time.monotonic()
+            for subscription in subscriptions:
+                subscription.offer(value, now)
+
+    def flush(self, now=None):
+        """
+        投递全部已到期的暂存值
+        :return: 距下一个暂存值到期的时间(s)，无暂存值时为 None
+        """
+        if now is None:
+            now = time.monotonic()
+        next_due = None
+        for subscriptions in list(self.__subscriptions.values()):
+            for subscription in subscriptions:
+                subscription.flush(now)
+                due = subscription.due()
+                if due is not None and (next_due is None or due < next_due):
+                    next_due = due
+        return None if next_due is None else max(0.0, next_due - now)
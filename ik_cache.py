@@ -0,0 +1,159 @@
+"""
+This module includes a bounded LRU cache of inverse-kinematics solutions.
+Keys are the target pose quantized to `pose_step` and the seed configuration quantized to the coarser `seed_step`
+(the seed only selects the solution branch), values are the solutions of kinematics.ik().
+Batched lookups solve all misses in one kinematics.ik() call. The cache can be saved to and loaded from an
+.npz file, so warm starts survive restarts. Solutions belong to the geometry set with kinematics.configure():
+the cache is cleared when the geometry changes, and a file saved with other parameters is not loaded.
+Class: IKCache      ik() ik_batch() get_stats() clear() save() load()
+Author: Mr SoSimple
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import kinematics
+
+
+class IKCache(object):
+    def __init__(self, maxsize=4096, pose_step=0.01, seed_step=5.0):
+        """
+        :param maxsize: 最多缓存的解数，满时淘汰最久未用的
+        :param pose_step: 位姿量化步长，mm / 度
+        :param seed_step: 初值量化步长(度)
+        """
+        super(IKCache, self).__init__()
+        self.maxsize = maxsize
+        self.pose_step = pose_step
+        self.seed_step = seed_step
+        self.__entries = OrderedDict()  # key -> (joints, converged)
+        self.__version = kinematics.version()  # 缓存的解所属的几何参数版本
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def __keys(self, poses, seeds):
+        pose_keys = np.round(poses / self.pose_step).astype(np.int64)
+        seed_keys = np.round(seeds / self.seed_step).astype(np.int64)
+        return [tuple(row) for row in np.hstack((pose_keys, seed_keys)).tolist()]
+
+    def ik(self, pose, seed=None, **kwargs):
+        """
+        带缓存的 kinematics.ik()
+        :param pose: (6,) 目标位姿 X Y Z A B C
+        :param seed: (6,) 初值(度)，None 为零位
+        :return: (joints, converged)
+        """
+        joints, converged = self.ik_batch([pose], None if seed is None else [seed], **kwargs)
+        return joints[0], bool(converged[0])
+
+    def ik_batch(self, poses, seeds=None, **kwargs):
+        """
+        带缓存的批量逆解，未命中的目标一次求解
+        :param poses: (N, 6)
+        :param seeds: (N, 6) 或 (6,)，None 为零位
+        :param kwargs: 见 kinematics.ik()
+        :return: (joints, converged)，(N, 6) 与 (N,)
+        """
+        poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+        seeds = np.zeros((len(poses), 6)) if seeds is None else \
+            np.broadcast_to(np.asarray(seeds, dtype=float).reshape(-1, 6), poses.shape)
+        kinematics.require_configured()
+        keys = self.__keys(poses, seeds)
+        joints = np.empty((len(poses), 6))
+        converged = np.empty(len(poses), dtype=bool)
+        missing = []
+        with self.__lock:
+            self.__check_version()
+            for i, key in enumerate(keys):
+                entry = self.__entries.get(key)
+                if entry is None:
+                    missing.append(i)
+                else:
+                    self.__entries.move_to_end(key)
+                    joints[i], converged[i] = entry
+            self.__hits += len(poses) - len(missing)
+            self.__misses += len(missing)
+        if missing:
+            solved, solved_converged = kinematics.ik(poses[missing], seeds[missing], **kwargs)
+            joints[missing] = solved
+            converged[missing] = solved_converged
+            with self.__lock:
+                if self.__version == kinematics.version():
+                    for i in missing:
+                        self.__store(keys[i], (joints[i].copy(), bool(converged[i])))
+        return joints, converged
+
+    def __check_version(self):
+        # 几何参数变了，之前的解不再有效
+        if self.__version != kinematics.version():
+            self.__entries.clear()
+            self.__version = kinematics.version()
+
+    def __store(self, key, entry):
+        self.__entries[key] = entry
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.maxsize:
+            self.__entries.popitem(last=False)
+            self.__evictions += 1
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def get_stats(self):
+        """
+        :return: dict，hits/misses/evictions 次数，hit_rate 命中率，size 当前缓存数
+        """
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {'size': len(self.__entries),
+                    'maxsize': self.maxsize,
+                    'hits': self.__hits,
+                    'misses': self.__misses,
+                    'evictions': self.__evictions,
+                    'hit_rate': self.__hits / lookups if lookups else 0.0}
+
+    def save(self, path):
+        """
+        按最久未用到最近使用的顺序保存到 .npz 文件，连同所属的几何参数
+        :raise kinematics.CalibrationError: 尚未设置几何参数
+        """
+        geometry = kinematics.parameters()
+        with self.__lock:
+            self.__check_version()
+            keys = np.array(list(self.__entries.keys()), dtype=np.int64).reshape(-1, 12)
+            joints = np.array([entry[0] for entry in self.__entries.values()]).reshape(-1, 6)
+            converged = np.array([entry[1] for entry in self.__entries.values()], dtype=bool)
+        np.savez(path, keys=keys, joints=joints, converged=converged,
+                 steps=np.array([self.pose_step, self.seed_step]), geometry=geometry)
+
+    def load(self, path):
+        """
+        从 save() 保存的文件载入，量化步长或几何参数不同的文件被忽略
+        :return: bool, 载入成功返回 True
+        """
+        try:
+            geometry = kinematics.parameters()
+            with np.load(path) as data:
+                if not np.allclose(data['steps'], [self.pose_step, self.seed_step]):
+                    print('IK cache error: ', 'quantization steps differ, {} ignored'.format(path))
+                    return False
+                if data['geometry'].shape != geometry.shape or not np.allclose(data['geometry'], geometry):
+                    print('IK cache error: ', 'kinematics parameters differ, {} ignored'.format(path))
+                    return False
+                keys, joints, converged = data['keys'], data['joints'], data['converged']
+        except (OSError, KeyError, ValueError, kinematics.CalibrationError) as e:
+            print('IK cache error: ', e)
+            return False
+        with self.__lock:
+            self.__check_version()
+            for key, solution, ok in zip(keys.tolist(), joints, converged):
+                self.__store(tuple(key), (solution, bool(ok)))
+        return True
@@ -0,0 +1,286 @@
+"""
+This module includes the forward and inverse kinematics of the SANXI 6-DOF arm, vectorized with NumPy:
+every function takes one joint vector / pose, or a batch of N of them as an (N, 6) array.
+Units follow the controller: lengths in mm, angles in degrees, poses as X Y Z A B C with the
+orientation R = Rz(C) * Ry(B) * Rx(A). The 7th cartesian value D of the controller is an external axis
+and is not part of the kinematics.
+There is no built-in geometry: the DH table, joint limits and workspace of your arm must be set with
+configure() or load() from calibrated values; until then every function that needs them raises CalibrationError.
+Class: CalibrationError
+Functions: configure() load() is_configured() require_configured() parameters() version()
+           fk() fk_matrices() ik() ik_path() pose_to_matrix() matrix_to_pose()
+Author: Mr SoSimple
+"""
+
+import json
+
+import numpy as np
+
+
+# 几何参数，由 configure() 设置：标准 DH 参数 d(mm)、a(mm)、alpha(rad)、theta 零位偏移(rad)
+DH_D = None
+DH_A = None
+DH_ALPHA = None
+DH_OFFSET = None
+JOINT_LIMITS = None  # (6, 2) 关节限位(度)，每行 (下限, 上限)
+WORKSPACE = None  # (3, 2) 工作空间(mm)：末端位置的包围盒，每行 (下限, 上限)
+SHOULDER = None  # 第 2 轴中心
+REACH = None  # 末端到第 2 轴中心的最大距离(mm)
+_version = 0  # 每次 configure() 加一，缓存据此判断逆解是否过期
+_ORIENTATION_SCALE = 300.0  # 姿态误差(rad)换算为等效长度(mm)，使位置和姿态误差量级相当
+
+
+class CalibrationError(RuntimeError):
+    """
+    尚未用 configure()/load() 设置标定的几何参数
+    """
+    pass
+
+
+def configure(dh_d, dh_a, dh_alpha, dh_offset, joint_limits, workspace):
+    """
+    设置本机标定的几何参数
+    :param dh_d: (6,) 标准 DH 参数 d(mm)
+    :param dh_a: (6,) a(mm)
+    :param dh_alpha: (6,) alpha(度)
+    :param dh_offset: (6,) theta 零位偏移(度)
+    :param joint_limits: (6, 2) 关节限位(度)，每行 (下限, 上限)
+    :param workspace: (3, 2) 工作空间(mm)，末端位置的包围盒，每行 (下限, 上限)
+    :raise ValueError: 参数形状不对
+    """
+    global DH_D, DH_A, DH_ALPHA, DH_OFFSET, JOINT_LIMITS, WORKSPACE, SHOULDER, REACH, _version
+    dh = [np.asarray(values, dtype=float) for values in (dh_d, dh_a, dh_alpha, dh_offset)]
+    joint_limits = np.asarray(joint_limits, dtype=float)
+    workspace = np.asarray(workspace, dtype=float)
+    if any(values.shape != (6,) for values in dh) or joint_limits.shape != (6, 2) or workspace.shape != (3, 2):
+        raise ValueError('DH parameters must have 6 values, joint limits 6x2 and workspace 3x2')
+    DH_D, DH_A = dh[0], dh[1]
+    DH_ALPHA, DH_OFFSET = np.radians(dh[2]), np.radians(dh[3])
+    JOINT_LIMITS = joint_limits
+    WORKSPACE = workspace
+    SHOULDER = np.array([0.0, 0.0, DH_D[0]])
+    REACH = DH_A[1] + DH_D[3] + DH_D[5]
+    _version += 1
+
+
+def load(path):
+    """
+    从 JSON 文件读取标定参数并 configure()，键为 configure() 的参数名
+    :param path: 文件路径
+    :raise OSError, ValueError, KeyError: 文件不存在或内容不合法
+    """
+    with open(path) as f:
+        data = json.load(f)
+    configure(data['dh_d'], data['dh_a'], data['dh_alpha'], data['dh_offset'],
+              data['joint_limits'], data['workspace'])
+
+
+def is_configured():
+    return DH_D is not None
+
+
+def require_configured():
+    """
+    :raise CalibrationError: 尚未设置几何参数
+    """
+    if DH_D is None:
+        raise CalibrationError('kinematics not configured, call kinematics.configure() or kinematics.load() '
+                               'with the calibrated parameters of the arm')
+
+
+def version():
+    """
+    :return: int，几何参数的版本，每次 configure() 加一，未设置为 0
+    """
+    return _version
+
+
+def parameters():
+    """
+    :return: (48,) 全部几何参数，用于判断保存的数据是否属于同一组参数
+    """
+    require_configured()
+    return np.concatenate([DH_D, DH_A, DH_ALPHA, DH_OFFSET, JOINT_LIMITS.ravel(), WORKSPACE.ravel()])
+
+
+def _as_batch(values, width):
+    values = np.asarray(values, dtype=float)
+    return values.reshape(-1, width), values.ndim == 1
+
+
+def _frames(joints):
+    """
+    :param joints: (N, 6) 关节角(度)
+    :return: (N, 7, 4, 4)，基座系及各连杆坐标系在基座系中的齐次矩阵
+    :raise CalibrationError: 尚未设置几何参数
+    """
+    require_configured()
+    theta = np.radians(joints) + DH_OFFSET
+    n = len(theta)
+    ct, st = np.cos(theta), np.sin(theta)
+    ca, sa = np.cos(DH_ALPHA), np.sin(DH_ALPHA)
+    links = np.zeros((n, 6, 4, 4))
+    links[..., 0, 0] = ct
+    links[..., 0, 1] = -st * ca
+    links[..., 0, 2] = st * sa
+    links[..., 0, 3] = DH_A * ct
+    links[..., 1, 0] = st
+    links[..., 1, 1] = ct * ca
+    links[..., 1, 2] = -ct * sa
+    links[..., 1, 3] = DH_A * st
+    links[..., 2, 1] = sa
+    links[..., 2, 2] = ca
+    links[..., 2, 3] = DH_D
+    links[..., 3, 3] = 1.0
+    frames = np.empty((n, 7, 4, 4))
+    frames[:, 0] = np.eye(4)
+    for i in range(6):
+        frames[:, i + 1] = np.matmul(frames[:, i], links[:, i])
+    return frames
+
+
+def fk_matrices(joints):
+    """
+    正运动学
+    :param joints: (6,) 或 (N, 6) 关节角(度)
+    :return: (4, 4) 或 (N, 4, 4) 末端齐次矩阵
+    """
+    joints, single = _as_batch(joints, 6)
+    matrices = _frames(joints)[:, 6]
+    return matrices[0] if single else matrices
+
+
+def fk(joints):
+    """
+    正运动学
+    :param joints: (6,) 或 (N, 6) 关节角(度)
+    :return: (6,) 或 (N, 6) 末端位姿 X Y Z A B C
+    """
+    joints, single = _as_batch(joints, 6)
+    poses = matrix_to_pose(_frames(joints)[:, 6])
+    return poses[0] if single else poses
+
+
+def pose_to_matrix(poses):
+    """
+    :param poses: (6,) 或 (N, 6) 位姿 X Y Z A B C
+    :return: (4, 4) 或 (N, 4, 4)
+    """
+    poses, single = _as_batch(poses, 6)
+    a, b, c = np.radians(poses[:, 3]), np.radians(poses[:, 4]), np.radians(poses[:, 5])
+    ca, sa, cb, sb, cc, sc = np.cos(a), np.sin(a), np.cos(b), np.sin(b), np.cos(c), np.sin(c)
+    matrices = np.zeros((len(poses), 4, 4))
+    matrices[:, 0, 0] = cc * cb
+    matrices[:, 0, 1] = cc * sb * sa - sc * ca
+    matrices[:, 0, 2] = cc * sb * ca + sc * sa
+    matrices[:, 1, 0] = sc * cb
+    matrices[:, 1, 1] = sc * sb * sa + cc * ca
+    matrices[:, 1, 2] = sc * sb * ca - cc * sa
+    matrices[:, 2, 0] = -sb
+    matrices[:, 2, 1] = cb * sa
+    matrices[:, 2, 2] = cb * ca
+    matrices[:, :3, 3] = poses[:, :3]
+    matrices[:, 3, 3] = 1.0
+    return matrices[0] if single else matrices
+
+
+def matrix_to_pose(matrices):
+    """
+    :param matrices: (4, 4) 或 (N, 4, 4)
+    :return: (6,) 或 (N, 6) 位姿 X Y Z A B C，B 在 [-90, 90] 度内
+    """
+    matrices = np.asarray(matrices, dtype=float)
+    single = matrices.ndim == 2
+    matrices = matrices.reshape(-1, 4, 4)
+    r = matrices[:, :3, :3]
+    poses = np.empty((len(matrices), 6))
+    poses[:, :3] = matrices[:, :3, 3]
+    poses[:, 3] = np.arctan2(r[:, 2, 1], r[:, 2, 2])
+    poses[:, 4] = np.arcsin(np.clip(-r[:, 2, 0], -1.0, 1.0))
+    poses[:, 5] = np.arctan2(r[:, 1, 0], r[:, 0, 0])
+    poses[:, 3:] = np.degrees(poses[:, 3:])
+    return poses[0] if single else poses
+
+
+def _pose_error(current, target):
+    """
+    :param current, target: (N, 4, 4)
+    :return: (N, 6)，位置误差(mm)与按 _ORIENTATION_SCALE 换算的姿态误差
+    """
+    error = np.empty((len(current), 6))
+    error[:, :3] = target[:, :3, 3] - current[:, :3, 3]
+    # 小角度姿态误差：0.5 * sum(当前轴 x 目标轴)
+    error[:, 3:] = 0.5 * np.cross(current[:, :3, :3], target[:, :3, :3], axis=1).sum(axis=2) * _ORIENTATION_SCALE
+    return error
+
+
+def _jacobian(frames):
+    """
+    几何雅可比矩阵
+    :param frames: (N, 7, 4, 4)，见 _frames()
+    :return: (N, 6, 6)，每弧度关节角引起的末端速度，姿态行按 _ORIENTATION_SCALE 换算
+    """
+    z = frames[:, :6, :3, 2]
+    p = frames[:, :6, :3, 3]
+    end = frames[:, 6:7, :3, 3]
+    jacobian = np.empty((len(frames), 6, 6))
+    jacobian[:, :3, :] = np.cross(z, end - p).transpose(0, 2, 1)
+    jacobian[:, 3:, :] = z.transpose(0, 2, 1) * _ORIENTATION_SCALE
+    return jacobian
+
+
+def ik(poses, seeds=None, tolerance=1e-3, max_iterations=100, damping=1.0):
+    """
+    逆运动学，阻尼最小二乘迭代，全部目标同时求解
+    :param poses: (6,) 或 (N, 6) 目标位姿 X Y Z A B C
+    :param seeds: (6,) 或 (N, 6) 初值(度)，应取接近目标的构型(如当前关节角)，None 为零位
+    :param tolerance: 收敛阈值，位置 mm / 等效姿态 mm
+    :param max_iterations: 最大迭代次数
+    :param damping: 阻尼系数，越大越稳定、收敛越慢
+    :return: (joints, converged)，(6,)/(N, 6) 关节角(度)与 bool/(N,) 是否收敛；关节角不检查限位
+    """
+    poses, single = _as_batch(poses, 6)
+    targets = pose_to_matrix(poses)
+    joints = np.zeros((len(poses), 6))
+    if seeds is not None:
+        joints[:] = np.asarray(seeds, dtype=float).reshape(-1, 6)
+    converged = np.zeros(len(poses), dtype=bool)
+    active = np.arange(len(poses))
+    identity = np.eye(6) * damping ** 2
+    for _ in range(max_iterations):
+        frames = _frames(joints[active])
+        error = _pose_error(frames[:, 6], targets[active])
+        done = np.abs(error).max(axis=1) < tolerance
+        converged[active[done]] = True
+        keep = ~done
+        active = active[keep]
+        if not len(active):
+            break
+        jacobian = _jacobian(frames[keep])
+        jacobian_t = jacobian.transpose(0, 2, 1)
+        step = np.matmul(jacobian_t, np.linalg.solve(np.matmul(jacobian, jacobian_t) + identity,
+                                                     error[keep][:, :, None]))[:, :, 0]
+        joints[active] += np.degrees(step)
+    # 关节角归一化到 [-180, 180)，第 6 轴除外
+    joints[:, :5] = (joints[:, :5] + 180.0) % 360.0 - 180.0
+    if single:
+        return joints[0], bool(converged[0])
+    return joints, converged
+
+
+def ik_path(poses, seed=None, **kwargs):
+    """
+    沿路径逐点求逆解，每点以上一点的解为初值，使构型连续
+    :param poses: (N, 6) 路径位姿
+    :param seed: (6,) 第一点的初值(度)，通常为当前关节角
+    :param kwargs: 见 ik()
+    :return: (joints, converged)，(N, 6) 与 (N,)
+    """
+    poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+    joints = np.zeros((len(poses), 6))
+    converged = np.zeros(len(poses), dtype=bool)
+    previous = np.zeros(6) if seed is None else np.asarray(seed, dtype=float)
+    for i, pose in enumerate(poses):
+        joints[i], converged[i] = ik(pose, previous, **kwargs)
+        previous = joints[i]
+    return joints, converged
@@ -0,0 +1,155 @@
+"""
+This module includes an analytic estimator of the duration of SANXI moves.
+A move is timed with a trapezoidal velocity profile (accelerate with AC, cruise at VE, decelerate with DE;
+triangular when too short to reach VE): for joint moves the slowest joint, for line moves the X Y Z distance.
+All functions work on batches. The nominal limits can be calibrated against moves recorded in telemetry
+(pose_history.PoseHistory): the effective velocity, the effective acceleration and a constant overhead are fitted.
+Class: MotionEstimator      estimate() calibrate()
+Functions: trapezoid_time() extract_moves()
+Author: Mr SoSimple
+"""
+
+import numpy as np
+
+
+def trapezoid_time(distance, v_max, a_max, d_max=None):
+    """
+    起止静止的梯形速度曲线运动时间，向量化
+    :param distance: array，距离(mm 或 度)
+    :param v_max: 速度
+    :param a_max: 加速度
+    :param d_max: 减速度，None 为与加速度相同
+    :return: 与 distance 同形的时间(s)
+    """
+    distance = np.abs(np.asarray(distance, dtype=float))
+    if d_max is None:
+        d_max = a_max
+    ramp = v_max * v_max / 2.0 * (1.0 / a_max + 1.0 / d_max)  # 加速到 v_max 再减速到 0 所需距离
+    peak = np.sqrt(2.0 * distance * a_max * d_max / (a_max + d_max))  # 三角形曲线的峰值速度
+    return np.where(distance >= ramp,
+                    distance / v_max + v_max / 2.0 * (1.0 / a_max + 1.0 / d_max),
+                    peak / a_max + peak / d_max)
+
+
+def extract_moves(times, values, threshold=0.5, min_duration=0.05):
+    """
+    从记录的位姿中找出各次运动
+    :param times: (k,) 时刻(s)，见 PoseHistory.window()
+    :param values: (k, dim) 位姿
+    :param threshold: 速度阈值(度/s 或 mm/s)，任一轴超过时视为在运动
+    :param min_duration: 短于此时长的运动被忽略(s)
+    :return: (starts (m, dim), ends (m, dim), durations (m,))
+    """
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    dim = values.shape[1] if values.ndim == 2 else 0
+    if len(times) < 3:
+        return np.zeros((0, dim)), np.zeros((0, dim)), np.zeros(0)
+    speed = np.abs(np.diff(values, axis=0) / np.diff(times)[:, None]).max(axis=1)
+    moving = np.concatenate(([False], speed > threshold, [False]))
+    edges = np.diff(moving.astype(int))
+    # 第 i 个采样区间在运动：起点为该区间起点，终点为最后一个运动区间的终点
+    begin = np.flatnonzero(edges == 1)
+    finish = np.flatnonzero(edges == -1)
+    durations = times[finish] - times[begin]
+    keep = durations >= min_duration
+    begin, finish = begin[keep], finish[keep]
+    return values[begin], values[finish], durations[keep]
+
+
+class MotionEstimator(object):
+    def __init__(self, v_max, a_max, d_max=None, space='joint'):
+        """
+        :param v_max: 速度(度/s 或 mm/s)
+        :param a_max: 加速度
+        :param d_max: 减速度，None 为与加速度相同
+        :param space: 'joint'——各关节同步，取最慢的关节；'cartesian'——按 X Y Z 直线距离
+        """
+        super(MotionEstimator, self).__init__()
+        self.v_max = v_max
+        self.a_max = a_max
+        self.d_max = a_max if d_max is None else d_max
+        self.space = space
+        self.velocity_scale = 1.0  # 标定得到的有效速度 / 名义速度
+        self.acceleration_scale = 1.0  # 标定得到的有效加减速度 / 名义加减速度
+        self.overhead = 0.0  # 每次运动的固定耗时(s)，如控制器开始执行的延迟
+
+    def distances(self, starts, targets):
+        """
+        :param starts, targets: (n, dim) 或 (dim,)
+        :return: (n,) 决定运动时间的距离
+        """
+        starts = np.atleast_2d(np.asarray(starts, dtype=float))
+        targets = np.atleast_2d(np.asarray(targets, dtype=float))
+        if self.space == 'joint':
+            return np.abs(targets[:, :6] - starts[:, :6]).max(axis=1)
+        return np.linalg.norm(targets[:, :3] - starts[:, :3], axis=1)
+
+    def estimate(self, starts, targets):
+        """
+        估计运动时间
+        :param starts: (n, dim) 或 (dim,) 起点
+        :param targets: (n, dim) 或 (dim,) 终点
+        :return: (n,) 时间(s)
+        """
+        return self.__time(self.distances(starts, targets), self.velocity_scale, self.acceleration_scale,
+                           self.overhead)
+
+    def __time(self, distance, velocity_scale, acceleration_scale, overhead):
+        duration = trapezoid_time(distance, self.v_max * velocity_scale, self.a_max * acceleration_scale,
+                                  self.d_max * acceleration_scale)
+        return duration + overhead * (distance > 0)
+
+    def calibrate(self, starts, targets, durations, iterations=50):
+        """
+        用记录的运动标定有效速度、加速度与固定耗时(Levenberg-Marquardt 最小二乘)
+        :param starts, targets: (m, dim) 记录的运动起止位姿，见 extract_moves()
+        :param durations: (m,) 实测时间(s)
+        :return: dict，标定前后的平均绝对误差(s)与标定结果
+        """
+        distance = self.distances(starts, targets)
+        durations = np.asarray(durations, dtype=float)
+        before = float(np.abs(self.estimate(starts, targets) - durations).mean()) if len(durations) else None
+        if len(durations) < 3:
+            print('Calibration error: ', 'at least 3 recorded moves are needed')
+            return {'moves': len(durations), 'error_before': before, 'error_after': before}
+        # 参数：log 速度比例、log 加速度比例、固定耗时；数据不足以区分各参数时阻尼使其保持在原值附近
+        params = np.array([np.log(self.velocity_scale), np.log(self.acceleration_scale), self.overhead])
+        bounds = np.array([[-5.0, 5.0], [-5.0, 5.0], [0.0, max(10.0, float(durations.max()))]])
+        step = 1e-6
+        damping = 1e-3
+
+        def residual(p):
+            return self.__time(distance, np.exp(p[0]), np.exp(p[1]), p[2]) - durations
+        r = residual(params)
+        cost = float(r.dot(r))
+        for _ in range(iterations):
+            jacobian = np.empty((len(r), 3))
+            for k in range(3):
+                shifted = params.copy()
+                shifted[k] += step
+                jacobian[:, k] = (residual(shifted) - r) / step
+            normal = jacobian.T.dot(jacobian)
+            delta = np.linalg.solve(normal + damping * np.diag(np.diag(normal) + 1e-9), -jacobian.T.dot(r))
+            candidate = np.clip(params + np.clip(delta, -1.0, 1.0), bounds[:, 0], bounds[:, 1])
+            r_candidate = residual(candidate)
+            cost_candidate = float(r_candidate.dot(r_candidate))
+            if cost_candidate < cost:
+                converged = cost - cost_candidate < 1e-12 * max(cost, 1e-12)
+                params, r, cost = candidate, r_candidate, cost_candidate
+                damping = max(damping / 10.0, 1e-9)
+                if converged:
+                    break
+            else:
+                damping *= 10.0
+                if damping > 1e9:
+                    break
+        self.velocity_scale = float(np.exp(params[0]))
+        self.acceleration_scale = float(np.exp(params[1]))
+        self.overhead = float(max(params[2], 0.0))
+        return {'moves': len(durations),
+                'error_before': before,
+                'error_after': float(np.abs(self.estimate(starts, targets) - durations).mean()),
+                'velocity_scale': self.velocity_scale,
+                'acceleration_scale': self.acceleration_scale,
+                'overhead': self.overhead}
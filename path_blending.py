@@ -0,0 +1,204 @@
+"""
+This module includes the merging of consecutive G21 line moves into fewer, longer lines.
+The controller brings every G21 line to a full stop before the next one starts and has no command that
+runs through a corner without stopping, so the only time that can be saved is the stops themselves:
+within a run of consecutive G21 commands, a target is dropped when the path from the last kept target to
+a later one passes within `tolerance` mm of it (and its A B C D are within `angle_tolerance` of the
+linear interpolation), so a polyline is replaced by as few lines as the tolerance allows.
+Commands are streamed: at most `lookahead` G21 targets are held back at a time.
+The estimated cycle time of the original and of the merged lines is reported, both timed as rest-to-rest
+trapezoidal moves along X Y Z; these are estimates, not measurements.
+Class: PathBlender      blend() report
+Usage: python path_blending.py PROGRAM [--tolerance MM] [--velocity MM/S] [--acceleration MM/S2] [--lookahead N]
+Author: Mr SoSimple
+"""
+
+import argparse
+
+import numpy as np
+
+
+RECT_KEYS = ('X', 'Y', 'Z', 'A', 'B', 'C', 'D')
+
+
+def _trapezoid_times(lengths, v0, v1, v_max, a_max):
+    """
+    一段直线在给定起止速度下的最短时间，向量化
+    :param lengths: (k,) 段长(mm)
+    :param v0, v1: (k,) 起止速度，需满足加速度可达
+    :return: (k,) 时间(s)
+    """
+    peak = np.minimum(v_max, np.sqrt((2.0 * a_max * lengths + v0 ** 2 + v1 ** 2) / 2.0))
+    accelerate = (peak ** 2 - v0 ** 2) / (2.0 * a_max)
+    decelerate = (peak ** 2 - v1 ** 2) / (2.0 * a_max)
+    cruise = np.maximum(lengths - accelerate - decelerate, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cruise_time = np.where(peak > 0, cruise / peak, 0.0)
+    return (peak - v0) / a_max + (peak - v1) / a_max + cruise_time
+
+
+def stop_time(points, v_max, a_max):
+    """
+    逐段起止静止运动的时间估计
+    :param points: (k, 3)
+    :return: float (s)
+    """
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    zeros = np.zeros(len(lengths))
+    return float(_trapezoid_times(lengths, zeros, zeros, v_max, a_max).sum())
+
+
+class PathBlender(object):
+    def __init__(self, tolerance=1.0, v_max=25.0, a_max=25.0, start=None, angle_tolerance=0.1, lookahead=4):
+        """
+        :param tolerance: 去掉的路径点离新直线的最大距离(mm)
+        :param v_max: 最大速度(mm/s)
+        :param a_max: 最大加速度(mm/s^2)
+        :param start: 起点位姿 X Y Z A B C D，None 为未知(从第一条给出全部轴的 G21 开始合并)
+        :param angle_tolerance: 去掉的路径点 A B C D 与直线插值之差的最大值(度)
+        :param lookahead: 最多暂存的 G21 目标数，内存与延迟不随程序长度增长
+        """
+        super(PathBlender, self).__init__()
+        self.tolerance = tolerance
+        self.v_max = v_max
+        self.a_max = a_max
+        self.angle_tolerance = angle_tolerance
+        self.lookahead = max(1, int(lookahead))
+        self.__pose = None if start is None else np.asarray(start, dtype=float)[:7].copy()
+        self.__anchor = None  # 最后发出的 G21 目标(或起点)
+        self.__pending = []  # 暂存的 G21 目标，可能被去掉
+        self.report = {'commands_in': 0, 'commands_out': 0, 'merged': 0,
+                       'estimated_original_time': 0.0, 'estimated_time': 0.0,
+                       'estimated_saved_time': 0.0, 'estimated_saved_percent': 0.0}
+
+    def blend(self, commands):
+        """
+        合并命令流中连续的 G21 命令，其他命令原样通过；最多暂存 lookahead 条 G21
+        :param commands: 规范化的命令行，见 program_runner.encode_line()
+        :return: 生成器，产生命令行；结束后 report 为本程序的统计
+        """
+        for command in commands:
+            self.report['commands_in'] += 1
+            if command.startswith('G21 '):
+                for line in self.__add(command):
+                    yield line
+                continue
+            for line in self.__flush():
+                yield line
+            self.__track(command)
+            self.report['commands_out'] += 1
+            yield command
+        for line in self.__flush():
+            yield line
+
+    def __track(self, command):
+        # 跟踪非 G21 命令后的直角坐标位姿；G07 只改参数，其他命令(关节运动、单轴点动等)之后位姿未知
+        if command.startswith('G20 '):
+            if self.__pose is not None:
+                self.__pose = self.__target(self.__pose, command)
+        elif not command.startswith('G07 '):
+            self.__pose = None
+
+    @staticmethod
+    def __target(previous, command):
+        target = previous.copy()
+        for word in command.split()[1:]:
+            key, value = word.split('=')
+            target[RECT_KEYS.index(key)] = float(value)
+        return target
+
+    def __add(self, command):
+        """
+        :return: list of 需要发出的命令行
+        """
+        previous = self.__pose if self.__pose is not None else np.full(7, np.nan)
+        target = self.__target(previous, command)
+        self.__pose = None if np.isnan(target).any() else target
+        if self.__pose is None:
+            # 位姿未知：原样发出
+            lines = self.__flush()
+            self.report['commands_out'] += 1
+            return lines + [command]
+        if self.__anchor is None:
+            if np.isnan(previous).any():
+                # 起点未知：该目标原样发出，作为之后合并的起点
+                self.__anchor = target
+                self.report['commands_out'] += 1
+                return [command]
+            self.__anchor = previous
+        self.report['estimated_original_time'] += stop_time(
+            np.array([previous[:3], target[:3]]), self.v_max, self.a_max)
+        last = self.__pending[-1] if self.__pending else self.__anchor
+        if np.abs(target - last).max() <= 1e-9:
+            # 与上一个目标重合，不需要运动
+            self.report['merged'] += 1
+            return []
+        lines = []
+        if self.__pending and not self.__covers(self.__pending, target):
+            # 新目标与暂存点不在容差内的同一直线上：发出最后一个暂存点，从它重新开始
+            lines.append(self.__emit(self.__pending[-1]))
+            self.__pending = []
+        self.__pending.append(target)
+        if len(self.__pending) > self.lookahead:
+            lines.append(self.__emit(self.__pending[-1]))
+            self.__pending = []
+        return lines
+
+    def __covers(self, pending, target):
+        # 暂存点是否都在 anchor -> target 直线的容差内，且沿直线依次前进
+        points = np.array(pending)
+        start = self.__anchor
+        direction = target[:3] - start[:3]
+        length2 = float(direction.dot(direction))
+        if length2 <= 1e-18:
+            return False
+        t = (points[:, :3] - start[:3]).dot(direction) / length2
+        if (t <= 0).any() or (t >= 1).any() or (np.diff(t) < 0).any():
+            return False
+        nearest = start + t[:, None] * (target - start)
+        distance = np.linalg.norm(points[:, :3] - nearest[:, :3], axis=1)
+        angles = np.abs(points[:, 3:] - nearest[:, 3:])
+        return bool((distance <= self.tolerance).all() and (angles <= self.angle_tolerance).all())
+
+    def __emit(self, target):
+        self.report['merged'] += len(self.__pending) - 1
+        self.report['estimated_time'] += stop_time(np.array([self.__anchor[:3], target[:3]]), self.v_max, self.a_max)
+        self.__anchor = target
+        self.report['commands_out'] += 1
+        original = self.report['estimated_original_time']
+        self.report['estimated_saved_time'] = original - self.report['estimated_time']
+        if original:
+            self.report['estimated_saved_percent'] = self.report['estimated_saved_time'] / original * 100
+        return 'G21 ' + ' '.join('{0}={1:.3f}'.format(key, value) for key, value in zip(RECT_KEYS, target)) + '\n'
+
+    def __flush(self):
+        # 一串 G21 结束：发出最后一个暂存点
+        lines = []
+        if self.__pending:
+            lines.append(self.__emit(self.__pending[-1]))
+            self.__pending = []
+        self.__anchor = None
+        return lines
+
+
+if __name__ == '__main__':
+    from program_runner import encode_line
+    parser = argparse.ArgumentParser(description='Merge the G21 moves of a program and report the estimated time saved')
+    parser.add_argument('program', help='G-code program file')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='path tolerance (mm)')
+    parser.add_argument('--velocity', type=float, default=25.0, help='maximum velocity (mm/s)')
+    parser.add_argument('--acceleration', type=float, default=25.0, help='maximum acceleration (mm/s^2)')
+    parser.add_argument('--lookahead', type=int, default=4, help='G21 targets held back at most')
+    parser.add_argument('--output', help='write the merged program to this file')
+    args = parser.parse_args()
+    blender = PathBlender(args.tolerance, args.velocity, args.acceleration, lookahead=args.lookahead)
+    with open(args.program) as source:
+        blended_lines = blender.blend(command for command in map(encode_line, source) if command is not None)
+        if args.output:
+            with open(args.output, 'w') as output:
+                output.writelines(blended_lines)
+        else:
+            for _ in blended_lines:
+                pass
+    for name in sorted(blender.report):
+        print('{0:>24}: {1:.3f}'.format(name, blender.report[name]))
@@ -0,0 +1,128 @@
+"""
+This module includes a fixed-size, NumPy-backed ring buffer of timestamped pose samples.
+Memory stays constant however long it runs; queries copy only the samples they need.
+Class: PoseHistory
+Methods:    append() window() at() velocity() acceleration()
+Author: Mr SoSimple
+"""
+
+import threading
+
+import numpy as np
+
+
+class PoseHistory(object):
+    def __init__(self, capacity=4096, dim=6):
+        """
+        :param capacity: 最多保存的采样数，写满后覆盖最旧的采样
+        :param dim: 每个采样的维数，关节空间 6，笛卡尔空间 7
+        """
+        super(PoseHistory, self).__init__()
+        self.capacity = capacity
+        self.dim = dim
+        self.__times = np.zeros(capacity)
+        self.__values = np.zeros((capacity, dim))
+        self.__count = 0  # 累计写入的采样数
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.__count, self.capacity)
+
+    def append(self, timestamp, values):
+        """
+        写入一个采样，时间戳应单调不减
+        :param timestamp: float (s)
+        :param values: 长度为 dim 的序列
+        """
+        with self.__lock:
+            index = self.__count % self.capacity
+            self.__times[index] = timestamp
+            self.__values[index] = values
+            self.__count += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__count = 0
+
+    def __segments(self):
+        # 按时间顺序排列的两段缓冲区视图(旧段, 新段)，不复制
+        if self.__count <= self.capacity:
+            return [(self.__times[:self.__count], self.__values[:self.__count])]
+        start = self.__count % self.capacity
+        return [(self.__times[start:], self.__values[start:]),
+                (self.__times[:start], self.__values[:start])]
+
+    def window(self, t_start=None, t_end=None, pad=0):
+        """
+        取时间窗口 [t_start, t_end] 内的采样，只复制窗口内的数据
+        :param t_start: 起始时间，None 为最早的采样
+        :param t_end: 结束时间，None 为最新的采样
+        :param pad: 窗口两侧各多取的采样数，供插值使用
+        :return: (times, values)，shape (n,) 与 (n, dim)，按时间递增
+        """
+        with self.__lock:
+            segments = self.__segments()
+            total = sum(len(times) for times, _ in segments)
+            # 整体按时间递增，分段二分查找后求和即为窗口在逻辑序列中的位置
+            first = 0 if t_start is None else sum(
+                int(np.searchsorted(times, t_start, 'left')) for times, _ in segments)
+            last = total if t_end is None else sum(
+                int(np.searchsorted(times, t_end, 'right')) for times, _ in segments)
+            first = max(0, first - pad)
+            last = min(total, last + pad)
+            parts_t = []
+            parts_v = []
+            offset = 0
+            for times, values in segments:
+                lo = max(first - offset, 0)
+                hi = min(last - offset, len(times))
+                if lo < hi:
+                    parts_t.append(times[lo:hi])
+                    parts_v.append(values[lo:hi])
+                offset += len(times)
+            if not parts_t:
+                return np.zeros(0), np.zeros((0, self.dim))
+            return np.concatenate(parts_t), np.concatenate(parts_v)
+
+    def at(self, t):
+        """
+        线性插值得到时刻 t 的位姿，超出记录范围时取端点值
+        :param t: float 或 array of float
+        :return: shape (dim,) 或 (len(t), dim)
+        """
+        t = np.asarray(t, dtype=float)
+        times, values = self.window(t.min(), t.max(), pad=1)
+        if not len(times):
+            raise ValueError('pose history is empty')
+        result = np.empty(t.shape + (self.dim,))
+        for axis in range(self.dim):
+            result[..., axis] = np.interp(t, times, values[:, axis])
+        return result
+
+    def velocity(self, t_start=None, t_end=None):
+        """
+        有限差分速度估计
+        :return: (times, velocities)，单位：值/s
+        """
+        times, values = self.__unique_window(t_start, t_end)
+        if len(times) < 2:
+            return times, np.zeros((len(times), self.dim))
+        return times, np.gradient(values, times, axis=0)
+
+    def acceleration(self, t_start=None, t_end=None):
+        """
+        有限差分加速度估计
+        :return: (times, accelerations)，单位：值/s^2
+        """
+        times, velocities = self.velocity(t_start, t_end)
+        if len(times) < 2:
+            return times, np.zeros((len(times), self.dim))
+        return times, np.gradient(velocities, times, axis=0)
+
+    def __unique_window(self, t_start, t_end):
+        # 去掉时间戳重复的采样，避免差分时除以零
+        times, values = self.window(t_start, t_end)
+        if len(times) > 1:
+            keep = np.concatenate(([True], np.diff(times) > 0))
+            times, values = times[keep], values[keep]
+        return times, values
@@ -0,0 +1,192 @@
+"""
+This module includes a watcher of pose conditions against the live telemetry stream, to sequence moves
+without sleeps. Every condition is kept as one row of lower/upper bounds on the pose axes, plus a time it must
+hold continuously; all pending rows are evaluated together on each sample, in one vectorized pass:
+    within      every given axis within tolerance of its target, e.g. J3 within 0.1 degree of 45
+    above/below one axis above or below a value, e.g. Z above 200
+    stationary  the pose stays within tolerance of where it was for a duration, e.g. 50 ms; the bounds are
+                re-anchored on the current sample whenever the pose leaves them
+A condition that becomes true resolves its future with (timestamp, values) and calls its callback, then it is
+removed; a cancelled condition never calls its callback.
+Hold times use the sample timestamps; timeouts use time.monotonic() and are checked by expire().
+Class: PoseWatcher      within() above() below() stationary() update() expire() cancel_all()
+Author: Mr SoSimple
+"""
+
+import concurrent.futures
+import threading
+import time
+
+import numpy as np
+
+
+class PoseWatcher(object):
+    def __init__(self, keys):
+        """
+        :param keys: 位姿各轴的名称，如 ('J1', ..., 'J6') 或 ('X', 'Y', 'Z', 'A', 'B', 'C', 'D')
+        """
+        super(PoseWatcher, self).__init__()
+        self.keys = tuple(keys)
+        dim = len(self.keys)
+        # 每个条件一行
+        self.__lower = np.zeros((0, dim))  # 各轴下限，不限为 -inf
+        self.__upper = np.zeros((0, dim))  # 各轴上限，不限为 inf
+        self.__band = np.zeros((0, dim))  # 静止条件各轴允许的变化量
+        self.__stationary = np.zeros(0, dtype=bool)
+        self.__hold = np.zeros(0)  # 需持续满足的时间(s)
+        self.__since = np.zeros(0)  # 开始满足的采样时刻，未满足为 nan
+        self.__deadline = np.zeros(0)  # time.monotonic() 超时时刻，不超时为 inf
+        self.__entries = []  # [future, callback]
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def within(self, target, tolerance=0.1, hold=0.0, callback=None, timeout=None):
+        """
+        各轴都在目标的允许误差内
+        :param target: 字典——目标值，{'J3': 45.0, ...}，空值的轴不检查
+        :param tolerance: 允许误差，度或毫米
+        :param hold: 需持续满足的时间(s)
+        :param callback: callback(timestamp, values)，在解析线程中调用
+        :param timeout: 超时(s)，超时后 Future 以 concurrent.futures.TimeoutError 结束；None 为不超时
+        :return: concurrent.futures.Future，结果为 (timestamp, values)
+        """
+        lower, upper = self.__unbounded()
+        for key, value in target.items():
+            if value in ('', ' ', None):
+                continue
+            index = self.keys.index(key)
+            lower[index] = float(value) - tolerance
+            upper[index] = float(value) + tolerance
+        return self.__add(lower, upper, None, hold, callback, timeout)
+
+    def above(self, key, value, hold=0.0, callback=None, timeout=None):
+        """
+        某轴不低于 value，参数见 within()
+        """
+        lower, upper = self.__unbounded()
+        lower[self.keys.index(key)] = value
+        return self.__add(lower, upper, None, hold, callback, timeout)
+
+    def below(self, key, value, hold=0.0, callback=None, timeout=None):
+        """
+        某轴不高于 value，参数见 within()
+        """
+        lower, upper = self.__unbounded()
+        upper[self.keys.index(key)] = value
+        return self.__add(lower, upper, None, hold, callback, timeout)
+
+    def stationary(self, duration=0.05, tolerance=0.01, keys=None, callback=None, timeout=None):
+        """
+        位姿在 duration 内的变化不超过 tolerance
+        :param duration: 静止时间(s)
+        :param tolerance: 各轴允许的变化，度或毫米
+        :param keys: 检查的轴，None 为全部
+        :return: concurrent.futures.Future，其他参数见 within()
+        """
+        band = np.full(len(self.keys), np.inf)
+        band[[self.keys.index(key) for key in (self.keys if keys is None else keys)]] = tolerance
+        # 下限为 nan 时第一个采样即重新定位
+        lower = np.full(len(self.keys), np.nan)
+        return self.__add(lower, lower.copy(), band, duration, callback, timeout)
+
+    def __unbounded(self):
+        return np.full(len(self.keys), -np.inf), np.full(len(self.keys), np.inf)
+
+    def __add(self, lower, upper, band, hold, callback, timeout):
+        future = concurrent.futures.Future()
+        deadline = np.inf if timeout is None else time.monotonic() + timeout
+        with self.__lock:
+            self.__lower = np.vstack((self.__lower, lower))
+            self.__upper = np.vstack((self.__upper, upper))
+            self.__band = np.vstack((self.__band, np.zeros(len(self.keys)) if band is None else band))
+            self.__stationary = np.append(self.__stationary, band is not None)
+            self.__hold = np.append(self.__hold, hold)
+            self.__since = np.append(self.__since, np.nan)
+            self.__deadline = np.append(self.__deadline, deadline)
+            self.__entries.append([future, callback])
+        return future
+
+    def __remove(self, mask):
+        keep = ~mask
+        self.__lower = self.__lower[keep]
+        self.__upper = self.__upper[keep]
+        self.__band = self.__band[keep]
+        self.__stationary = self.__stationary[keep]
+        self.__hold = self.__hold[keep]
+        self.__since = self.__since[keep]
+        self.__deadline = self.__deadline[keep]
+        self.__entries = [entry for entry, kept in zip(self.__entries, keep.tolist()) if kept]
+
+    def update(self, timestamp, values):
+        """
+        用一个采样评估全部条件，满足的条件完成并移除
+        :param timestamp: 采样时刻(s)
+        :param values: 长度为 len(keys) 的位姿
+        :return: 本次满足并触发的条件数(不含已取消的)
+        """
+        if not self.__entries:
+            return 0
+        values = np.asarray(values, dtype=float)
+        with self.__lock:
+            if not self.__entries:
+                return 0
+            inside = ((values >= self.__lower) & (values <= self.__upper)).all(axis=1)
+            # 静止条件离开范围时以当前采样为中心重新定位，重新计时
+            anchor = self.__stationary & ~inside
+            if anchor.any():
+                self.__lower[anchor] = values - self.__band[anchor]
+                self.__upper[anchor] = values + self.__band[anchor]
+                self.__since[anchor] = timestamp
+                inside |= anchor
+            self.__since[~inside] = np.nan
+            self.__since[inside & np.isnan(self.__since)] = timestamp
+            done = inside & (timestamp - self.__since >= self.__hold)
+            if not done.any():
+                return 0
+            fired = [self.__entries[index] for index in np.flatnonzero(done)]
+            self.__remove(done)
+        # 在锁外完成 Future 与回调，回调中可以登记新的条件
+        count = 0
+        for future, callback in fired:
+            if not future.set_running_or_notify_cancel():
+                continue  # 已取消的条件不再触发回调
+            count += 1
+            future.set_result((timestamp, values))
+            if callback is not None:
+                try:
+                    callback(timestamp, values)
+                except Exception as e:
+                    print('Pose watcher callback error: ', e)
+        return count
+
+    def expire(self):
+        """
+        使超时的条件以 TimeoutError 结束，并移除已取消的条件
+        :return: 距下一个条件超时的时间(s)，没有时为 None
+        """
+        if not self.__entries:
+            return None
+        now = time.monotonic()
+        with self.__lock:
+            cancelled = np.array([entry[0].cancelled() for entry in self.__entries], dtype=bool)
+            expired = (self.__deadline <= now) & ~cancelled
+            futures = [self.__entries[index][0] for index in np.flatnonzero(expired)]
+            if (expired | cancelled).any():
+                self.__remove(expired | cancelled)
+            next_deadline = float(self.__deadline.min()) if len(self.__deadline) else np.inf
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(concurrent.futures.TimeoutError('pose condition not met within timeout'))
+        return None if next_deadline == np.inf else next_deadline - now
+
+    def cancel_all(self):
+        """
+        取消全部未满足的条件
+        """
+        with self.__lock:
+            entries = self.__entries
+            self.__remove(np.ones(len(entries), dtype=bool))
+        for future, _ in entries:
+            future.cancel()
@@ -0,0 +1,205 @@
+"""
+This module includes a streaming runner of G-code programs for the SANXI robot.
+The program is read lazily line by line, each line is validated and normalized just before it is sent,
+and sending is flow-controlled by command_pipeline.CommandPipeline, so programs of any length run in constant memory.
+Class: ProgramRunner    start() pause() resume() abort() wait() get_progress()
+       ProgramError     an invalid program line, with its line number
+Functions: encode_line()
+Author: Mr SoSimple
+"""
+
+import os
+import threading
+
+from command_pipeline import CommandPipeline, COMMAND_TIMEOUT
+
+
+JOINT_KEYS = ('J1', 'J2', 'J3', 'J4', 'J5', 'J6')
+RECT_KEYS = ('X', 'Y', 'Z', 'A', 'B', 'C', 'D')
+PARA_KEYS = ('VE', 'AC', 'DE', 'GCM')
+MOTION_HEADS = {'G00': JOINT_KEYS, 'G20': RECT_KEYS, 'G21': RECT_KEYS, 'G07': PARA_KEYS}
+
+
+class ProgramError(ValueError):
+    def __init__(self, line_no, line, reason):
+        super(ProgramError, self).__init__('line {0}: {1} ({2})'.format(line_no, line, reason))
+        self.line_no = line_no
+        self.line = line
+
+
+def encode_line(line):
+    """
+    检查并规范化一行程序，';' 之后为注释
+    :param line: string
+    :return: string, 规范化后的命令行(带 '\\n')；空行或注释行返回 None
+    :raise ValueError: 命令或参数不合法
+    """
+    line = line.split(';', 1)[0].strip()
+    if not line:
+        return None
+    words = line.upper().split()
+    head = words[0]
+    if head in MOTION_HEADS:
+        keys = MOTION_HEADS[head]
+        if len(words) < 2:
+            raise ValueError('no target')
+        for word in words[1:]:
+            key, sep, value = word.partition('=')
+            if not sep or key not in keys:
+                raise ValueError('unknown word {}'.format(word))
+            float(value)
+    elif len(head) == 3 and head[0] == 'J' and head[1] in '123456' and head[2] in '+-0':
+        if len(words) > 1:
+            raise ValueError('jog takes no arguments')
+    else:
+        raise ValueError('unknown command {}'.format(head))
+    return ' '.join(words) + '\n'
+
+
+class ProgramRunner(object):
+    # 运行状态
+    IDLE = 'idle'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    FINISHED = 'finished'
+    ABORTED = 'aborted'
+    FAILED = 'failed'
+
+    def __init__(self, sanxi, program, window=8, timeout=COMMAND_TIMEOUT, blender=None):
+        """
+        :param sanxi: 已连接并已 start_update_sanxi_output() 的 sanxi_core.Sanxi
+        :param program: 程序文件路径，或逐行产生命令的可迭代对象(如 GUI 文本框的各行)
+        :param window: 在途命令数，见 CommandPipeline
+        :param timeout: 每条命令等待回送的超时(s)，见 CommandPipeline
+        :param blender: path_blending.PathBlender，合并连续的 G21 命令；None 为不合并
+        """
+        super(ProgramRunner, self).__init__()
+        self.sanxi = sanxi
+        self.program = program
+        self.pipeline = CommandPipeline(sanxi, window, timeout)
+        self.blender = blender
+        self.state = self.IDLE
+        self.error = None  # 失败原因
+        self.__total_bytes = os.path.getsize(program) if isinstance(program, str) else None
+        self.__bytes_read = 0
+        self.__line_no = 0
+        self.__running = threading.Event()  # 清除时暂停发送
+        self.__running.set()
+        self.__aborted = False
+        self.__thread = None
+
+    def start(self):
+        self.state = self.RUNNING
+        self.__thread = threading.Thread(target=self.__run, name='Sanxi_Program')
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def pause(self):
+        """
+        暂停发送新命令，已在控制器缓冲区中的命令仍会执行完
+        """
+        if self.state == self.RUNNING:
+            self.__running.clear()
+            self.state = self.PAUSED
+
+    def resume(self):
+        if self.state == self.PAUSED:
+            self.state = self.RUNNING
+            self.__running.set()
+
+    def abort(self):
+        """
+        中止程序：停止发送，并以 \\x30 中止运动、清空控制器缓冲区
+        """
+        if self.state in (self.RUNNING, self.PAUSED):
+            self.__aborted = True
+            self.__running.set()
+            self.sanxi.stop()
+            self.pipeline.cancel()
+
+    def wait(self, timeout=None):
+        """
+        :return: bool, 程序已结束(完成、中止或失败)返回 True
+        """
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        return self.state in (self.FINISHED, self.ABORTED, self.FAILED)
+
+    def get_progress(self):
+        """
+        :return: dict，line_no 已读行号，sent/completed 命令数，fraction 按读取字节数估计的进度(可迭代对象输入时为 None)
+        """
+        stats = self.pipeline.get_stats()
+        fraction = None
+        if self.__total_bytes:
+            fraction = self.__bytes_read / self.__total_bytes
+        return {'state': self.state,
+                'line_no': self.__line_no,
+                'sent': stats['sent'],
+                'completed': stats['completed'],
+                'in_flight': stats['in_flight'],
+                'fraction': fraction,
+                'error': self.error,
+                'blend': None if self.blender is None else dict(self.blender.report)}
+
+    def __lines(self):
+        if isinstance(self.program, str):
+            with open(self.program, 'rb') as f:
+                for raw in f:
+                    self.__bytes_read += len(raw)
+                    yield raw.decode(errors='replace')
+        else:
+            for line in self.program:
+                yield line
+
+    def __commands(self):
+        # 逐行检查并规范化，跳过空行与注释
+        for line in self.__lines():
+            self.__line_no += 1
+            try:
+                command = encode_line(line)
+            except ValueError as e:
+                raise ProgramError(self.__line_no, line.strip(), e)
+            if command is not None:
+                yield command
+
+    def __run(self):
+        try:
+            self.sanxi.changeto_mode14()
+            commands = self.__commands()
+            if self.blender is not None:
+                commands = self.blender.blend(commands)
+            for command in commands:
+                self.__running.wait()
+                if self.__aborted or self.__check_failed():
+                    break
+                if command.startswith('G07'):
+                    self.sanxi.invalidate_para_mirror()  # 程序修改了参数，参数镜像不再可信；模式不变
+                while self.pipeline.submit(command, timeout=0.1) is None:
+                    if self.__aborted:
+                        break
+        except Exception as e:
+            # 包括 ProgramError：不再发送，已发送的命令照常执行完
+            self.error = str(e)
+        try:
+            while not self.__aborted and not self.pipeline.drain(timeout=0.1):
+                pass
+        except Exception as e:
+            self.error = str(e)
+        if self.__aborted:
+            self.pipeline.cancel()  # abort() 之后才发出的命令
+            self.state = self.ABORTED
+        elif self.error is not None or self.__check_failed():
+            print('Program error: ', self.error)
+            self.state = self.FAILED
+        else:
+            self.state = self.FINISHED
+
+    def __check_failed(self):
+        errors = self.pipeline.get_errors()
+        if errors:
+            command, error = errors[0]
+            self.error = '{0}: {1}'.format(command, error)
+            return True
+        return False
@@ -1,35 +1,103 @@
 """
 This module includes the core functions of SANXI robot
 Class: Sanxi, whose base class is RS232 in communication.py module
-Functions: search_origin()
+Functions: search_origin() back2origin()
 
 Author: Mr SoSimple
 """
 
 import threading
 import time
-import re
+import concurrent.futures
+from array import array
 
-from communication import Message_control
+from communication import Message_control, PRIORITY_QUERY
+from command_pipeline import COMMAND_TIMEOUT
+from event_bus import EventBus
+from ik_cache import IKCache
+from pose_history import PoseHistory
+from pose_watcher import PoseWatcher
+from path_blending import PathBlender
+from program_runner import ProgramRunner
+import sequence_optimizer
+import kinematics
+import motion_estimator
+import telemetry
+import trajectory
+import trajectory_check
 
 
+class CommandError(Exception):
+    """
+    控制器以 'ERR ...' 拒绝了命令
+    """
+    pass
+
+
+def _complete(future, result=None, error=None):
+    """
+    完成 Future；已取消或已被其他线程完成时忽略
+    :return: Bool，是否由本次调用完成
+    """
+    if future.done():
+        return False
+    try:
+        if not future.set_running_or_notify_cancel():
+            return False
+    except RuntimeError:
+        return False  # 其他线程已开始完成该 Future
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+    return True
+
 
 class Sanxi(Message_control):
     __VE_MAX = 250000  # 最大速度
     __AC_MAX = 250000  # 最大加速度
     __DE_MAX = 250000  # 最大减速度
+    STATE_CODES = telemetry.STATE_BYTES.decode()  # 控制器回送的状态字节
 
     def __init__(self):
         super(Sanxi, self).__init__()
-        self.__mode = '\x10'
-        self.return_code = ''  # Sanxi串口返回数据
-        self.jn_value = []  # 伪实时关节空间坐标值
-        self.xyz_value = []  # 伪实时笛卡尔空间坐标值
-        self.start_update_sanxi_output_timer = None
-        # 正则表达式预编译
-        self.G_detect_pattern = re.compile(r'.*G.*')  # 检测 G字符 与下面表达式联合抽取返回的坐标值
-        self.jn_pattern = re.compile(r'.*J1=(.*) J2=(.*) J3=(.*) J4=(.*) J5=(.*) J6=(.*)[\r\s]')
-        self.xyz_pattern = re.compile(r'.*X=(.*) Y=(.*) Z=(.*) A=(.*) B=(.*) C=(.*) D=(.*)[\r\s]')
+        self.__mode = None  # 控制器回送的当前状态字节
+        self.__mode_seq = 0  # 收到状态字节的次数
+        self.__mode_condition = threading.Condition()
+        self.set_frame_codes(self.STATE_CODES.encode())
+        # 控制器参数镜像 {'VE':, 'AC':, 'DE':, 'GCM':}，只发送有变化的参数，重连或出错时失效
+        self.__para_mirror = {}
+        self.__return_raw = b''  # Sanxi串口返回数据，按需解码
+        # 最新位姿快照 telemetry.PoseSnapshot，整体替换发布，读者总是看到完整的位姿
+        self.joint_pose = None  # 关节空间坐标
+        self.cartesian_pose = None  # 笛卡尔空间坐标
+        self.__pose_seq = 0  # 位姿序号，两种位姿共用，单调递增
+        self.__pose_condition = threading.Condition()
+        # 位姿历史环形缓冲区，可按时间插值、取窗口、估计速度与加速度
+        self.joint_history = PoseHistory(capacity=4096, dim=6)
+        self.cartesian_history = PoseHistory(capacity=4096, dim=7)
+        # 位姿条件，如 joint_watcher.within({'J3': 45}, 0.1)、cartesian_watcher.above('Z', 200)，每个采样评估一次
+        self.joint_watcher = PoseWatcher(['J1', 'J2', 'J3', 'J4', 'J5', 'J6'])
+        self.cartesian_watcher = PoseWatcher(['X', 'Y', 'Z', 'A', 'B', 'C', 'D'])
+        # 消息发布：主题 'message'(每条 communication.Message)、'joint'/'cartesian'(telemetry.PoseSnapshot)、
+        # 'status'(状态字节)、'echo'(命令回送文本)、'error'(报错文本)，在解析线程中投递
+        self.__bus = EventBus()
+        self.__status_futures = []  # 等待状态变化的 Future，消息流静默时查询状态
+        self.__last_message_time = 0.0
+        self.__last_status_poll = 0.0
+        self.status_poll_interval = 0.3  # 消息流静默多久(s)后查询状态
+        self.__estimators = {'joint': motion_estimator.MotionEstimator(1.0, 1.0, space='joint'),
+                             'cartesian': motion_estimator.MotionEstimator(1.0, 1.0, space='cartesian')}  # 限值由 get_estimator() 更新
+        self.__preflight_enabled = False  # 见 preflight
+        self.ik_cache = IKCache()  # 逆解缓存，可用 ik_cache.save()/load() 跨重启保留
+        self.__derive_cartesian = False  # True-由关节坐标经正运动学同时发布直角坐标
+        self.__streamers = []  # stream_joint_path() 启动的轨迹发送，stop() 时取消
+        # 等待者：[topic, predicate, future, deadline, consume]，在解析线程中按到达的数据完成 Future
+        self.__waiters = []
+        self.__waiter_lock = threading.Lock()
+        self.__commands = {}  # send_command() 中等待回送的等待者 -> 返回的 Future，\x30 时以 CommandError 结束
+        self.__output_thread = None  # 消息解析线程
+        self.__output_stopped = True
 
 
 
@@ -42,6 +110,7 @@ class Sanxi(Message_control):
         self.set_port(port_name)
         self.set_baud_rate(115200)
         self.set_timeout(0.1)
+        self.invalidate_state_mirror()
         if self.connect() is True:
             return True
         else:
@@ -52,6 +121,7 @@ class Sanxi(Message_control):
         断开三喜机器人串口连接
         :return: Bool
         """
+        self.invalidate_state_mirror()
         if self.disconnect():
             return True
         else:
@@ -64,132 +134,557 @@ class Sanxi(Message_control):
         :return: None
         """
         self.start_refresh()
-        self.start_update_sanxi_output_timer = threading.Timer(0.01, self.__extract_output_info)
-        self.start_update_sanxi_output_timer.start()
+        self.__output_stopped = False
+        self.__output_thread = threading.Thread(target=self.__thread_func_extract_output,
+                                                name='thread_func_extract_output')
+        self.__output_thread.start()
+
+    def __thread_func_extract_output(self):
+        # 阻塞等待接收队列中的下一条消息，收到即解析
+        timeout = 0.1
+        while not self.__output_stopped:
+            message = self.wait_message(timeout=timeout)
+            if message is not None:
+                self.__extract_output_info(message)
+            # 投递限速订阅者到期的合并数据，使超时的等待者失败，并按下一次到期时间决定等待时长
+            due = self.__bus.flush()
+            timeout = 0.1 if due is None else min(due, 0.1)
+            for deadline in (self.__expire_waiters(), self.joint_watcher.expire(), self.cartesian_watcher.expire()):
+                if deadline is not None:
+                    timeout = min(timeout, deadline)
+            self.__poll_status_if_silent()
+
+    def __poll_status_if_silent(self):
+        # 有等待状态的 Future 且返回消息流静默超过 status_poll_interval 时，才发送 \x05 查询状态
+        if not self.__status_futures:
+            return
+        self.__status_futures = [future for future in self.__status_futures if not future.done()]
+        now = time.monotonic()
+        if self.__status_futures and now - max(self.__last_message_time, self.__last_status_poll) \
+                >= self.status_poll_interval:
+            self.__last_status_poll = now
+            self.send('\x05', PRIORITY_QUERY)
+
+    def __extract_output_info(self, message):
+        """
+        抽取一条返回消息中的坐标信息与状态
+        :param message: communication.Message
+        :return: None
+        """
+        # update return_code
+        self.__last_message_time = time.monotonic()
+        self.__return_raw = message.raw
+        self.__publish('message', message)
+        # update state info
+        for event in telemetry.parse_frame(message.raw):
+            event_type = type(event)
+            if event_type is telemetry.JointPose:
+                self.__publish('joint', self.__publish_pose('joint', event.values, message.timestamp))
+                if self.__derive_cartesian:
+                    self.__publish('cartesian', self.__publish_pose(
+                        'cartesian', self.__derived_cartesian(event.values), message.timestamp))
+            elif event_type is telemetry.CartesianPose:
+                self.__publish('cartesian', self.__publish_pose('cartesian', event.values, message.timestamp))
+            elif event_type is telemetry.Status:
+                self.__update_mode(event.code)
+                self.__publish('status', event.code)
+            elif event_type is telemetry.Echo:
+                self.__publish('echo', event.text)
+            elif event_type is telemetry.Error:
+                # 控制器报错后不再信任镜像
+                self.invalidate_state_mirror()
+                self.__publish('error', event.text)
+
+    def __publish(self, topic, value):
+        self.__bus.publish(topic, value)
+        if self.__waiters:
+            self.__notify_waiters(topic, value)
+
+    def __notify_waiters(self, topic, value):
+        # 在锁外完成 Future，Future 的回调中可以再调用 expect()
+        matched = []
+        with self.__waiter_lock:
+            for waiter in list(self.__waiters):
+                waiter_topic, predicate, future, deadline, consume = waiter
+                if future.done():
+                    # 已取消，或已由其他途径结束(被拒绝、stop())
+                    self.__waiters.remove(waiter)
+                    continue
+                if waiter_topic != topic:
+                    continue
+                try:
+                    if not predicate(value):
+                        continue
+                    result = (future, value, None)
+                except Exception as e:
+                    result = (future, None, e)
+                self.__waiters.remove(waiter)
+                matched.append(result)
+                if consume:
+                    break
+        for future, result, error in matched:
+            _complete(future, result, error)
+
+    def __expire_waiters(self):
+        """
+        使超时的等待者以 TimeoutError 结束
+        :return: 距下一个等待者超时的时间(s)，没有时为 None
+        """
+        if not self.__waiters:
+            return None
+        now = time.monotonic()
+        next_deadline = None
+        expired = []
+        with self.__waiter_lock:
+            for waiter in list(self.__waiters):
+                future, deadline = waiter[2], waiter[3]
+                if future.done():
+                    self.__waiters.remove(waiter)
+                elif deadline is not None and deadline <= now:
+                    self.__waiters.remove(waiter)
+                    expired.append(waiter)
+                elif deadline is not None and (next_deadline is None or deadline < next_deadline):
+                    next_deadline = deadline
+        for waiter in expired:
+            _complete(waiter[2], error=concurrent.futures.TimeoutError(
+                'no matching {} within timeout'.format(waiter[0])))
+        return None if next_deadline is None else next_deadline - now
+
+    def expect(self, topic, predicate, timeout=None, consume=False):
+        """
+        等待返回消息中出现满足条件的数据，需先 start_update_sanxi_output()
+        :param topic: 同 subscribe() 的主题
+        :param predicate: predicate(value) 为真时完成
+        :param timeout: 超时(s)，超时后 Future 以 concurrent.futures.TimeoutError 结束；None 为不超时
+        :param consume: True-匹配的数据只完成最早登记的一个等待者，用于命令与回送一一对应
+        :return: concurrent.futures.Future，结果为匹配的数据；可用 cancel() 取消
+        """
+        future = concurrent.futures.Future()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__waiter_lock:
+            self.__waiters.append([topic, predicate, future, deadline, consume])
+        return future
+
+    def send_command(self, send_data, timeout=5.0):
+        """
+        发送一行命令，返回在控制器回送该命令时完成的 Future。
+        回送按登记顺序与命令一一对应：超时或取消后，该命令迟到的回送(或拒绝)仍由它自己的等待者接收，
+        不会完成之后发送的相同命令；\x30 清空控制器缓冲区时一并清除
+        :param send_data: string，命令行，如 'G00 J1=10\n'
+        :param timeout: 等待回送的超时(s)，None 为不超时；运动在控制器中排队时，开始执行才回送
+        :return: concurrent.futures.Future，结果为回送文本；控制器以 'ERR ...: <命令>' 拒绝时以 CommandError 结束
+        """
+        command = ' '.join(send_data.split()).upper()
+        future = concurrent.futures.Future()
+        echo = self.expect('echo', lambda text: ' '.join(text.split()).upper() == command, consume=True)
+        rejected = self.expect('error', lambda text: ' '.join(text.split(': ', 1)[-1].split()).upper() == command,
+                               consume=True)
+
+        def on_echo(f):
+            rejected.cancel()
+            self.__command_done(echo)
+            if not f.cancelled():
+                _complete(future, f.result())
+
+        def on_rejected(f):
+            if not f.cancelled():
+                echo.cancel()
+                _complete(future, error=CommandError(f.result()))
+
+        def on_timeout(f):
+            if not f.cancelled():
+                _complete(future, error=concurrent.futures.TimeoutError('no matching echo within timeout'))
+        with self.__waiter_lock:
+            self.__commands[echo] = future
+        echo.add_done_callback(on_echo)
+        rejected.add_done_callback(on_rejected)
+        if timeout is not None:
+            # 只用于计时的等待者，主题 None 不会被匹配；超时后回送的等待者保留
+            timer = self.expect(None, None, timeout)
+            timer.add_done_callback(on_timeout)
+            future.add_done_callback(lambda f: timer.cancel())
+        self.send(send_data)
+        return future
+
+    def __command_done(self, echo):
+        with self.__waiter_lock:
+            self.__commands.pop(echo, None)
+
+    def __fail_commands(self, reason):
+        """
+        \x30 清空了发送队列与控制器缓冲区，等待中的命令不会再回送，使其以 CommandError 结束，
+        并清除已超时命令的等待者
+        :param reason: string
+        """
+        with self.__waiter_lock:
+            commands = list(self.__commands.items())
+            self.__commands.clear()
+        for echo, future in commands:
+            _complete(future, error=CommandError(reason))
+            echo.cancel()
+
+    def wait_pose(self, space, target, tolerance=0.1, timeout=None):
+        """
+        等待位姿到达目标，需要返回数据模式与 space 一致
+        :param space: 'joint' 或 'cartesian'
+        :param target: 字典——目标值，{'J1': *, ...} 或 {'X': *, ...}，空值的轴不检查
+        :param tolerance: 允许误差，度或毫米
+        :param timeout: 超时(s)
+        :return: concurrent.futures.Future，结果为到达目标时的 telemetry.PoseSnapshot
+        """
+        keys = ['J1', 'J2', 'J3', 'J4', 'J5', 'J6'] if space == 'joint' else ['X', 'Y', 'Z', 'A', 'B', 'C', 'D']
+        checks = [(keys.index(key), float(value)) for key, value in target.items()
+                  if value not in ('', ' ', None)]
+
+        def reached(snapshot):
+            values = snapshot.values
+            return all(abs(values[index] - value) <= tolerance for index, value in checks)
+        snapshot = self.cartesian_pose if space == 'cartesian' else self.joint_pose
+        if snapshot is not None and reached(snapshot):
+            future = concurrent.futures.Future()
+            future.set_result(snapshot)
+            return future
+        return self.expect(space, reached, timeout)
+
+    def subscribe(self, topic, callback=None, min_interval=0.0, coalesce=False):
+        """
+        订阅返回消息，不增加轮询线程：回调在消息解析线程中调用
+        :param topic: 'message' / 'joint' / 'cartesian' / 'status' / 'echo' / 'error'
+        :param callback: callback(value)，为 None 时数据存入订阅的信箱，由 Subscription.poll() 取出
+        :param min_interval: 最小投递间隔(s)，如 GUI 取 0.02；控制回路取 0，收到每一个采样
+        :param coalesce: 限速期间只保留最新值，到期后投递
+        :return: event_bus.Subscription
+        """
+        return self.__bus.subscribe(topic, callback, min_interval, coalesce)
+
+    def unsubscribe(self, subscription):
+        self.__bus.unsubscribe(subscription)
+
+    @property
+    def preflight(self):
+        """
+        True-rect_move()/multi_joints_motion() 等发送前检查限位、工作空间与可达性，默认关闭；
+        需先用 kinematics.configure()/load() 设置本机标定的参数，否则打开时抛出 kinematics.CalibrationError
+        """
+        return self.__preflight_enabled
+
+    @preflight.setter
+    def preflight(self, enabled):
+        if enabled:
+            kinematics.require_configured()
+        self.__preflight_enabled = bool(enabled)
+
+    def set_derived_cartesian(self, enabled=True):
+        """
+        关节坐标返回模式下，由本地正运动学(kinematics.fk)同时得到直角坐标，
+        一个坐标流即可同时显示两种坐标，无需 set_return_data_mode() 切换
+        :param enabled: bool
+        :raise kinematics.CalibrationError: 打开时尚未设置标定的几何参数
+        """
+        if enabled:
+            kinematics.require_configured()
+        self.__derive_cartesian = enabled
+
+    def rect_to_joints(self, rect_dict, seed=None):
+        """
+        由直角坐标目标求关节角，使用逆解缓存
+        :param rect_dict: 字典——直角坐标目标值，{'X': *, ...}，空值的轴取当前位姿
+        :param seed: 初值(度)，None 为当前关节角
+        :return: (joints, converged)，joints 为 list of 6 float
+        :raise kinematics.CalibrationError: 尚未设置标定的几何参数
+        """
+        kinematics.require_configured()
+        if seed is None:
+            seed = self.joint_pose.values if self.joint_pose is not None else [0.0] * 6
+        if self.cartesian_pose is not None:
+            pose = list(self.cartesian_pose.values[:6])
+        else:
+            pose = kinematics.fk(seed).tolist()
+        for i, key in enumerate(['X', 'Y', 'Z', 'A', 'B', 'C']):
+            value = rect_dict.get(key, '')
+            if value not in ('', ' ', None):
+                pose[i] = float(value)
+        joints, converged = self.ik_cache.ik(pose, seed)
+        return joints.tolist(), converged
+
+    def __derived_cartesian(self, joints):
+        # 外部轴 D 不在运动学中，沿用最近一次的值
+        last = self.cartesian_pose
+        pose = kinematics.fk(joints).tolist()
+        pose.append(last.values[6] if last is not None else 0.0)
+        return pose
+
+    def __publish_pose(self, space, values, timestamp):
+        with self.__pose_condition:
+            self.__pose_seq += 1
+            snapshot = telemetry.PoseSnapshot(self.__pose_seq, timestamp, array('d', values))
+            if space == 'joint':
+                self.joint_pose = snapshot
+                self.joint_history.append(timestamp, values)
+            else:
+                self.cartesian_pose = snapshot
+                self.cartesian_history.append(timestamp, values)
+            self.__pose_condition.notify_all()
+        watcher = self.joint_watcher if space == 'joint' else self.cartesian_watcher
+        watcher.update(timestamp, values)
+        return snapshot
+
+    def get_pose(self, space='joint', min_seq=0, timeout=None):
+        """
+        获取最新位姿快照，可阻塞等待更新的位姿
+        :param space: 'joint' 或 'cartesian'
+        :param min_seq: 要求快照序号 >= min_seq，传入上次快照的 seq + 1 即等待下一个位姿
+        :param timeout: 最长等待时间(s)，None 为一直等待
+        :return: telemetry.PoseSnapshot，超时返回 None
+        """
+        attribute = 'joint_pose' if space == 'joint' else 'cartesian_pose'
+
+        def ready():
+            snapshot = getattr(self, attribute)
+            return snapshot is not None and snapshot.seq >= min_seq
+        with self.__pose_condition:
+            if self.__pose_condition.wait_for(ready, timeout):
+                return getattr(self, attribute)
+            return None
+
+    @property
+    def jn_value(self):
+        """
+        伪实时关节空间坐标值，list of float
+        """
+        snapshot = self.joint_pose
+        return list(snapshot.values) if snapshot is not None else []
+
+    @property
+    def xyz_value(self):
+        """
+        伪实时笛卡尔空间坐标值，list of float
+        """
+        snapshot = self.cartesian_pose
+        return list(snapshot.values) if snapshot is not None else []
+
+    @property
+    def return_code(self):
+        """
+        Sanxi串口最近返回的一条消息
+        """
+        return self.__return_raw.decode(errors='replace')
+
+    def __update_mode(self, state):
+        with self.__mode_condition:
+            self.__mode = state
+            self.__mode_seq += 1
+            self.__mode_condition.notify_all()
+
+    def get_mode(self):
+        """
+        控制器最近回送的状态字节，未知时为 None
+        :return: string
+        """
+        return self.__mode
+
+    def invalidate_state_mirror(self):
+        """
+        清空控制器状态镜像，之后的模式切换与参数设置都会完整发送
+        :return: None
+        """
+        with self.__mode_condition:
+            self.__mode = None
+        self.invalidate_para_mirror()
 
-    def __extract_output_info(self):
+    def invalidate_para_mirror(self):
         """
-        接收返回消息并抽取返回消息中的坐标信息
+        只清空运动参数与返回数据模式(G07)的镜像，不影响模式镜像，之后的参数设置都会完整发送
         :return: None
         """
-        # print('enter extract_output_info')
-        if self.return_code != self.message:
-            # update return_code
-            self.return_code = self.message
-            # print('return code =', self.return_code)
-            # update state info
-            jn_match = self.jn_pattern.match(str(self.return_code))  # 正则表达式匹配
-            xyz_match = self.xyz_pattern.match(str(self.return_code))
-            G_match = self.G_detect_pattern.match(str(self.return_code))
-            # print(jn_match, xyz_match, G_match)
-            if G_match is None:
-                if jn_match:
-                    self.jn_value.clear()
-                    for i in range(1, 7):
-                        self.jn_value.append(jn_match.group(i))
-                if xyz_match:
-                    self.xyz_value.clear()
-                    for i in range(1, 8):
-                        self.xyz_value.append(xyz_match.group(i))
-        self.start_update_sanxi_output_timer = threading.Timer(0.01, self.__extract_output_info)
-        self.start_update_sanxi_output_timer.start()
-        # print('leave extract_output_info')
+        self.__para_mirror.clear()
+
+    def send_control(self, code, timeout):
+        """
+        发送控制字节，等待控制器回送相同的状态字节，超时后继续(等同原来的固定延时)
+        :param code: 控制字节，如 '\x30'
+        :param timeout: 最长等待时间(s)
+        :return: Bool，是否收到回送
+        """
+        with self.__mode_condition:
+            seq = self.__mode_seq
+        self.send(code)
+        with self.__mode_condition:
+            return self.__mode_condition.wait_for(
+                lambda: self.__mode_seq != seq and self.__mode == code, timeout)
 
     def stop_update_sanxi_output(self):
         """
         停止更新机器人返回的消息，包括坐标信息
         :return: None
         """
-        self.start_update_sanxi_output_timer.cancel()
+        self.__output_stopped = True
         self.stop_refresh()
+        if self.__output_thread is not None and self.__output_thread is not threading.current_thread():
+            self.__output_thread.join()
+        self.__output_thread = None
 
-    def search_origin(self):
+    def search_origin(self, timeout=60.0):
         """
         启动搜寻原点内置程序，原理：限位光电开关
-        :return: None
+        :param timeout: 等待搜寻结束的超时(s)
+        :return: concurrent.futures.Future，搜寻结束(控制器回到 \x10 状态)时完成，超时以 TimeoutError 结束
         """
-        self.send('\x30')
-        time.sleep(0.1)
-        self.send('\x10')
-        time.sleep(0.1)
-        self.send('\x12')
-        time.sleep(0.1)
+        return self.__homing('\x12', timeout)
 
-    def back2origin(self, wait=False):
+    def back2origin(self, wait=False, timeout=60.0):
         """
         复位：回到原点
-        :return: None
+        :param wait: True-阻塞直到回原点结束或超时
+        :param timeout: 等待回原点结束的超时(s)
+        :return: concurrent.futures.Future，回原点结束(控制器回到 \x10 状态)时完成，超时以 TimeoutError 结束
         """
-        self.send('\x30')
-        time.sleep(0.1)
-        self.send('\x10')
-        time.sleep(0.1)
-        self.send('\x15')
-        time.sleep(0.1)
+        done = self.__homing('\x15', timeout)
         if wait:
-            while self.return_code != '\x10':
-                self.send('\x05')
-                time.sleep(0.3)
+            try:
+                done.result()
+            except Exception as e:
+                print('Back to origin error: ', e)
+        return done
 
-    def stop(self):
+    def __homing(self, code, timeout):
         """
-        quick stop
-        :return: None
+        中止当前运动后启动搜寻原点/回原点，完成由返回消息中的状态驱动，消息流静默时才查询状态
+        :param code: '\x12' 搜寻原点 或 '\x15' 回原点
+        :return: concurrent.futures.Future
+        """
+        entered = [False]
+
+        def finished(state):
+            # 先确认进入 code 状态，之后回到 \x10 即为结束
+            if state == code:
+                entered[0] = True
+                return False
+            return entered[0] and state == '\x10'
+        # 与 stop() 相同的中止：取消轨迹发送，等待回送的命令以 CommandError 结束
+        self.__abort('flushed by homing', 0.1)
+        self.send_control('\x10', 0.1)
+        done = self.expect('status', finished, timeout)
+        self.__status_futures = self.__status_futures + [done]
+        self.send_control(code, 0.1)
+        return done
+
+    def stop(self, wait=False):
         """
-        self.send('\x30')
-        time.sleep(0.2)
-        self.send('\x10')
-        time.sleep(0.1)
+        quick stop：\x30 不排队立即写出并清空排队的命令，控制器回送后再回到主菜单 \x10；
+        等待回送的命令(send_command() 的 Future)以 CommandError('flushed by stop') 结束
+        :param wait: True-阻塞直到回到主菜单或超时
+        :return: concurrent.futures.Future，回到主菜单时完成，0.3 s 内未完成以 TimeoutError 结束
+        """
+        if self.__output_stopped:
+            # 没有解析线程时收不到回送，直接回到主菜单
+            self.__abort('flushed by stop')
+            self.send_stop('\x10', flush=False)
+            done = concurrent.futures.Future()
+            done.set_result('\x10')
+            return done
+        aborted = [False]
+
+        def finished(state):
+            if state == '\x30':
+                aborted[0] = True
+                return False
+            return aborted[0] and state == '\x10'
+        done = self.expect('status', finished, 0.3)
+        # 收到 \x30 回送(或 0.2 s 后)再回到主菜单，不阻塞调用者
+        self.expect('status', lambda state: state == '\x30', 0.2).add_done_callback(
+            lambda f: self.send_stop('\x10', flush=False))
+        self.__abort('flushed by stop')
+        if wait:
+            try:
+                done.result()
+            except Exception as e:
+                print('Stop error: ', e)
+        return done
+
+    def __abort(self, reason, timeout=0):
+        """
+        发送 \x30 的唯一途径：取消正在发送的轨迹，\x30 不排队立即写出并清空排队的命令，
+        \x30 清空了控制器缓冲区，等待回送的命令以 CommandError(reason) 结束
+        :param reason: string
+        :param timeout: 等待控制器回送 \x30 的最长时间(s)，0 为不等待
+        :return: Bool，是否收到回送
+        """
+        for streamer in self.__streamers:
+            streamer.cancel()
+        self.__streamers = []
+        with self.__mode_condition:
+            seq = self.__mode_seq
+        self.send_stop('\x30')
+        self.__fail_commands(reason)
+        if not timeout:
+            return False
+        with self.__mode_condition:
+            return self.__mode_condition.wait_for(
+                lambda: self.__mode_seq != seq and self.__mode == '\x30', timeout)
 
     def set_motion_para(self, vep, acp, dep):
         """
-        设置运动参数
+        设置运动参数，只发送与镜像不同的参数
         :param vep: 速度百分比
         :param acp: 加速度百分比
         :param dep: 减速度百分比
         :return: None
         """
-        self.changeto_mode14()
         ve = vep * self.__VE_MAX / 100
         ac = acp * self.__AC_MAX / 100
         de = dep * self.__DE_MAX / 100
-        self.send('G07 VE={}\n'.format(str(ve)))
-        time.sleep(0.05)
-        self.send('G07 AC={}\n'.format(str(ac)))
-        time.sleep(0.05)
-        self.send('G07 DE={}\n'.format(str(de)))
-        time.sleep(0.05)
+        changed = [(key, value) for key, value in (('VE', ve), ('AC', ac), ('DE', de))
+                   if self.__para_mirror.get(key) != value]
+        if not changed:
+            return
+        self.changeto_mode14()
+        for key, value in changed:
+            # 收到回送后立即发送下一条，最多等待 0.05 s
+            echo = self.send_command('G07 {0}={1}\n'.format(key, str(value)), timeout=1.0)
+            self.__para_mirror[key] = value
+            concurrent.futures.wait([echo], timeout=0.05)
 
     def set_return_data_mode(self, mode='cartesian space'):
         """
-        设置返回数据模式，直角坐标模式 或 关节坐标模式，默认前者
+        设置返回数据模式，直角坐标模式 或 关节坐标模式，默认前者；与当前模式相同时不发送
         :param mode: string
         :return: Bool
         """
         if mode == 'cartesian space':
-            self.send('G07 GCM=1\n')
-            return True
+            gcm = 1
         elif mode == 'joint space':
-            self.send('G07 GCM=0\n')
-            return True
+            gcm = 0
         else:
             return False
+        if self.__para_mirror.get('GCM') != gcm:
+            self.send('G07 GCM={}\n'.format(gcm))
+            self.__para_mirror['GCM'] = gcm
+        return True
 
     def changeto_mode14(self):
-        self.send('\x30')
-        time.sleep(0.05)
-        self.send('\x10')
-        time.sleep(0.05)
-        self.send('\x14')
-        time.sleep(0.02)
+        """
+        切换到 14 号模式(命令模式)，每一步在收到控制器回送后立即继续；已确认处于 14 号模式时不发送。
+        切换经过 \x30，与 stop() 相同：正在发送的轨迹被取消，等待回送的命令以 CommandError 结束
+        :return: Bool，是否确认进入 14 号模式
+        """
+        if self.__mode == '\x14':
+            return True
+        self.__abort('flushed by mode change', 0.05)
+        self.send_control('\x10', 0.05)
+        return self.send_control('\x14', 0.02)
 
-    def rect_move(self, mode, **rect_dict):
+    def rect_move(self, mode, timeout=None, **rect_dict):
         """
         直角坐标运动，点对点, 或直线
         :param mode: mode='p2p' OR mode='line'
+        :param timeout: 等待回送的超时(s)，None 为不超时；之前的运动未结束时，本运动开始执行才回送
         :param rect_dict: 字典——直角坐标目标值，{'X': *, ...}
-        :return:
+        :return: concurrent.futures.Future，控制器回送该命令(开始执行)时完成；未通过发送前检查时以 CommandError 结束
         """
+        rejected = self.__preflight('cartesian', rect_dict)
+        if rejected is not None:
+            return rejected
         send_data = ''
         if mode == 'p2p':
             send_data += 'G20 '
@@ -201,14 +696,18 @@ class Sanxi(Message_control):
                 send_data += '{0}={1} '.format(key, str(rect_dict[key]))
         send_data += '\n'
         self.changeto_mode14()
-        self.send(send_data)
+        return self.send_command(send_data, timeout)
 
-    def multi_joints_motion(self, **j_dict):
+    def multi_joints_motion(self, timeout=None, **j_dict):
         """
         关节运动，点对点
+        :param timeout: 等待回送的超时(s)，None 为不超时；之前的运动未结束时，本运动开始执行才回送
         :param j_dict: 字典——六轴目标值，{'J*': **, ...}
-        :return:
+        :return: concurrent.futures.Future，控制器回送该命令(开始执行)时完成；未通过发送前检查时以 CommandError 结束
         """
+        rejected = self.__preflight('joint', j_dict)
+        if rejected is not None:
+            return rejected
         send_data = 'G00 '
         all_keys = []
         for i in range(1, 7):
@@ -218,14 +717,267 @@ class Sanxi(Message_control):
                 send_data += '{0}={1} '.format(key, str(j_dict[key]))
         send_data += '\n'
         self.changeto_mode14()
-        self.send(send_data)
+        return self.send_command(send_data, timeout)
+
+    def check_path(self, space, targets, seed=None):
+        """
+        发送前检查整条路径，见 trajectory_check
+        :param space: 'joint' 或 'cartesian'
+        :param targets: (N, 6) 关节角，或 (N, 6)/(N, 7) 直角坐标位姿
+        :param seed: 直角坐标路径逆解初值(度)，None 为当前关节角
+        :return: trajectory_check.CheckResult，index 为第一个违规点
+        """
+        if space == 'joint':
+            return trajectory_check.check_joints(targets)
+        if seed is None and self.joint_pose is not None:
+            seed = self.joint_pose.values
+        return trajectory_check.check_poses(targets, seed, ik_cache=self.ik_cache)
+
+    def __preflight(self, space, target_dict):
+        """
+        检查单个运动目标，空值的轴取当前位姿，当前位姿未知时不检查
+        :return: 不通过时返回以 CommandError 结束的 Future，通过返回 None
+        """
+        if not self.preflight:
+            return None
+        if space == 'joint':
+            keys, current = ['J1', 'J2', 'J3', 'J4', 'J5', 'J6'], self.joint_pose
+        else:
+            keys, current = ['X', 'Y', 'Z', 'A', 'B', 'C'], self.cartesian_pose
+        target = []
+        reason = None
+        for i, key in enumerate(keys):
+            value = target_dict.get(key, '')
+            if value in ('', ' ', None):
+                target.append(current.values[i] if current is not None else float('nan'))
+                continue
+            try:
+                target.append(float(value))
+            except ValueError:
+                reason = '{0}={1} is not a number'.format(key, value)
+                break
+        if reason is None:
+            if space == 'joint':
+                result = trajectory_check.check_joints([target])
+            elif any(value != value for value in target):
+                result = trajectory_check.check_workspace([target])  # 姿态未知，只检查位置
+            else:
+                result = self.check_path('cartesian', [target])
+            reason = result.reason
+        if reason is None:
+            return None
+        print('Preflight error: ', reason)
+        future = concurrent.futures.Future()
+        future.set_exception(CommandError(reason))
+        return future
+
+    def plan_joint_path(self, waypoints, vep=None, acp=None, dep=None):
+        """
+        多点关节路径的时间参数化，见 trajectory.plan_joint_path()
+        :param waypoints: (n, 6) 关节角(度)
+        :param vep, acp, dep: 速度、加速度、减速度百分比，None 为最近一次 set_motion_para() 的值，未设置过为 10
+        :return: trajectory.JointTrajectory
+        """
+        v_max, a_max = self.__motion_limits(vep, acp, dep, trajectory.UNITS_PER_DEGREE)
+        return trajectory.plan_joint_path(waypoints, v_max, a_max)
+
+    def __motion_parameters(self, vep=None, acp=None, dep=None):
+        # 控制器单位的 VE、AC、DE；百分比为 None 时取镜像中的运动参数，未设置过为 10%
+        values = []
+        for key, percent, limit in (('VE', vep, self.__VE_MAX), ('AC', acp, self.__AC_MAX), ('DE', dep, self.__DE_MAX)):
+            if percent is None:
+                value = self.__para_mirror.get(key)
+                percent = 10 if value is None else value * 100 / limit
+            values.append(percent * limit / 100)
+        return values
+
+    def __motion_limits(self, vep, acp, dep, units):
+        ve, ac, de = self.__motion_parameters(vep, acp, dep)
+        return trajectory.motion_limits(ve, ac, de, units)
+
+    def get_estimator(self, space='joint'):
+        """
+        运动时间估计器，限值取当前运动参数，保留已有的标定结果
+        :param space: 'joint' 或 'cartesian'
+        :return: motion_estimator.MotionEstimator
+        """
+        units = trajectory.UNITS_PER_DEGREE if space == 'joint' else trajectory.UNITS_PER_MM
+        ve, ac, de = self.__motion_parameters()
+        estimator = self.__estimators[space]
+        estimator.v_max, estimator.a_max, estimator.d_max = ve / units, ac / units, de / units
+        return estimator
+
+    def estimate_move(self, space, target_dict):
+        """
+        估计从当前位姿运动到目标的时间
+        :param space: 'joint'——multi_joints_motion()，'cartesian'——rect_move()
+        :param target_dict: 同 multi_joints_motion()/rect_move() 的参数，空值的轴不动
+        :return: float (s)，当前位姿未知时为 None
+        """
+        current = self.joint_pose if space == 'joint' else self.cartesian_pose
+        if current is None:
+            return None
+        keys = ['J1', 'J2', 'J3', 'J4', 'J5', 'J6'] if space == 'joint' else ['X', 'Y', 'Z', 'A', 'B', 'C', 'D']
+        target = list(current.values)
+        for i, key in enumerate(keys):
+            value = target_dict.get(key, '')
+            if value not in ('', ' ', None):
+                target[i] = float(value)
+        return float(self.get_estimator(space).estimate(current.values, target)[0])
+
+    def calibrate_estimator(self, space='joint', t_start=None, t_end=None):
+        """
+        用位姿记录中的运动标定时间估计器，需要对应的返回数据模式
+        :param space: 'joint' 或 'cartesian'
+        :param t_start, t_end: 记录的时间窗口，见 PoseHistory.window()
+        :return: dict，见 MotionEstimator.calibrate()
+        """
+        history = self.joint_history if space == 'joint' else self.cartesian_history
+        starts, targets, durations = motion_estimator.extract_moves(*history.window(t_start, t_end))
+        return self.get_estimator(space).calibrate(starts, targets, durations)
+
+    def stream_joint_path(self, joint_trajectory, rate=50.0, window=8, max_skip_ratio=0.1, max_jitter=None):
+        """
+        按计划频率发送轨迹的设定点(G00)，发送前检查整条轨迹；stop() 会取消正在发送的轨迹。
+        每个设定点在控制器中是一次点到点运动，跟不上计划频率时发送结束于 DEGRADED 状态，见 trajectory
+        :param joint_trajectory: trajectory.JointTrajectory，由 plan_joint_path() 生成
+        :param rate: 发送频率(Hz)
+        :param window: 在途设定点数，应不大于控制器运动命令缓冲区容量
+        :param max_skip_ratio, max_jitter: 见 trajectory.TrajectoryStreamer
+        :return: trajectory.TrajectoryStreamer，已开始发送；未通过检查时打印原因并返回 None
+        """
+        streamer = trajectory.TrajectoryStreamer(self, joint_trajectory, rate, window, max_skip_ratio, max_jitter)
+        if self.preflight:
+            result = trajectory_check.check_joints(streamer.positions)
+            if not result.ok:
+                print('Preflight error: ', 'setpoint {0}: {1}'.format(result.index, result.reason))
+                return None
+        # 先启动再登记：start() 中切换模式时会取消已登记的轨迹
+        streamer.start()
+        self.__streamers = [item for item in self.__streamers if item.state == item.RUNNING] + [streamer]
+        return streamer
+
+    def optimize_targets(self, targets, space='cartesian', fixed=()):
+        """
+        重排一批目标使总运动时间最短，从当前位姿出发，见 sequence_optimizer
+        :param targets: (n, 6) 关节角，或 (n, 6)/(n, 7) 直角坐标位姿
+        :param space: 'joint' 或 'cartesian'
+        :param fixed: 保持相对顺序的目标序号
+        :return: sequence_optimizer.SequenceResult
+        """
+        units = trajectory.UNITS_PER_DEGREE if space == 'joint' else trajectory.UNITS_PER_MM
+        v_max, a_max = self.__motion_limits(None, None, None, units)
+        current = self.joint_pose if space == 'joint' else self.cartesian_pose
+        start = None if current is None else list(current.values)
+        return sequence_optimizer.optimize_sequence(targets, v_max, a_max, space, start, fixed)
+
+    def move_sequence(self, targets, mode='p2p', optimize=True, fixed=(), window=8):
+        """
+        依次运动到一批目标，可先重排顺序；发送前检查整条路径
+        :param targets: mode 为 'joint' 时 (n, 6) 关节角，否则 (n, 6)/(n, 7) 直角坐标位姿
+        :param mode: 'joint'——G00，'p2p'——G20，'line'——G21
+        :param optimize: True-按 optimize_targets() 的顺序运动
+        :param fixed: 保持相对顺序的目标序号
+        :param window: 在途命令数
+        :return: program_runner.ProgramRunner；未通过检查时打印原因并返回 None
+        """
+        space = 'joint' if mode == 'joint' else 'cartesian'
+        targets = [list(target) for target in targets]
+        if optimize and len(targets) > 1:
+            targets = [targets[index] for index in self.optimize_targets(targets, space, fixed).order]
+        if self.preflight:
+            result = self.check_path(space, targets)
+            if not result.ok:
+                print('Preflight error: ', 'target {0}: {1}'.format(result.index, result.reason))
+                return None
+        if space == 'joint':
+            head, keys = 'G00', ['J1', 'J2', 'J3', 'J4', 'J5', 'J6']
+        else:
+            head, keys = 'G20' if mode == 'p2p' else 'G21', ['X', 'Y', 'Z', 'A', 'B', 'C', 'D']
+        lines = [head + ' ' + ' '.join('{0}={1:.3f}'.format(key, value) for key, value in zip(keys, target)) + '\n'
+                 for target in targets]
+        return self.run_program(lines, window)
+
+    def run_program(self, program, window=8, timeout=COMMAND_TIMEOUT, blend_tolerance=None):
+        """
+        流式执行 G 代码程序：逐行读取、检查，按在途窗口限流发送
+        :param program: 程序文件路径，或命令行的可迭代对象
+        :param window: 在途命令数，应不大于控制器运动命令缓冲区容量
+        :param timeout: 每条命令等待回送的超时(s)，控制器不回送时程序以失败结束而不是一直等待
+        :param blend_tolerance: 合并连续 G21 直线时路径的允许偏差(mm)，None 为不合并，见 path_blending
+        :return: program_runner.ProgramRunner，已开始运行，可 pause()/resume()/abort()/get_progress()
+        """
+        blender = None
+        if blend_tolerance is not None:
+            v_max, a_max = self.__motion_limits(None, None, None, trajectory.UNITS_PER_MM)
+            start = None if self.cartesian_pose is None else self.cartesian_pose.values
+            blender = PathBlender(blend_tolerance, v_max, a_max, start)
+        return ProgramRunner(self, program, window, timeout, blender).start()
+
+    def rect_move_async(self, mode, tolerance=0.1, timeout=None, **rect_dict):
+        """
+        直角坐标运动，返回在到达目标时完成的 Future，需要直角坐标返回数据模式
+        :param tolerance: 到位误差
+        :param timeout: 超时(s)
+        :return: concurrent.futures.Future，结果为到位时的 telemetry.PoseSnapshot
+        """
+        return self.__arrival('cartesian', rect_dict, self.rect_move(mode, timeout, **rect_dict), tolerance, timeout)
+
+    def multi_joints_motion_async(self, tolerance=0.1, timeout=None, **j_dict):
+        """
+        关节运动，返回在到达目标时完成的 Future，需要关节坐标返回数据模式
+        :param tolerance: 到位误差(度)
+        :param timeout: 超时(s)
+        :return: concurrent.futures.Future，结果为到位时的 telemetry.PoseSnapshot
+        """
+        return self.__arrival('joint', j_dict, self.multi_joints_motion(timeout, **j_dict), tolerance, timeout)
+
+    def __arrival(self, space, target, command, tolerance, timeout):
+        """
+        运动排队执行时，之前的运动可能经过目标；控制器回送本命令后，等位姿静止且在目标误差内才完成
+        :param command: 本命令的 send_command() Future
+        :return: concurrent.futures.Future
+        """
+        arrived = concurrent.futures.Future()
+        watcher = self.joint_watcher if space == 'joint' else self.cartesian_watcher
+        checks = [(watcher.keys.index(key), float(value)) for key, value in target.items()
+                  if value not in ('', ' ', None)]
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def fail(error):
+            if arrived.set_running_or_notify_cancel():
+                arrived.set_exception(error)
+
+        def wait_still(previous):
+            if arrived.done():
+                return
+            if previous.cancelled():
+                fail(concurrent.futures.CancelledError())
+                return
+            if previous.exception() is not None:
+                fail(previous.exception())
+                return
+            if previous is not command:
+                values = previous.result()[1]
+                if all(abs(values[index] - value) <= tolerance for index, value in checks):
+                    if arrived.set_running_or_notify_cancel():
+                        arrived.set_result(self.cartesian_pose if space == 'cartesian' else self.joint_pose)
+                    return
+            # 尚未开始运动、仍在运动或停在别处：等下一次静止
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                fail(concurrent.futures.TimeoutError('target not reached within timeout'))
+                return
+            watcher.stationary(0.05, min(tolerance, 0.01), timeout=remaining).add_done_callback(wait_still)
+        command.add_done_callback(wait_still)
+        return arrived
 
     def single_joint_motion_start(self, n, is_positive):
         """
         第n轴单轴运动
         :param n: 第n轴单动，eg 1   代表第一轴
         :param is_positive: True-顺时针或 向上, False-逆时针或向下
-        :return:
+        :return: concurrent.futures.Future，控制器回送该命令时完成
         """
         if n in [2, 3, 5]:
             if is_positive:
@@ -238,13 +990,13 @@ class Sanxi(Message_control):
             else:
                 send_data = 'J{}+\n'.format(str(n))
         self.changeto_mode14()
-        self.send(send_data)
+        return self.send_command(send_data)
 
     def single_joint_motion_stop(self, n):
         """
         第n轴停止单轴运动
         :param n: 第n轴停止单动，eg 1   代表第一轴
-        :return:
+        :return: concurrent.futures.Future，控制器回送该命令时完成
         """
         send_data = 'J{}0\n'.format(str(n))
-        self.send(send_data)
\ No newline at end of file
+        return self.send_command(send_data)
\ No newline at end of file
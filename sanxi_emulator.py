@@ -0,0 +1,267 @@
+"""
+This module includes an emulator of the SANXI robot controller, speaking its serial protocol over a Linux pty,
+so that sanxi_core.Sanxi can be exercised without the physical robot.
+Class: SanxiEmulator
+Methods:    start() stop()
+Protocol:   control bytes (accepted at the start of a line, answered with the new state byte, no line ending)
+                \\x30 abort: clear the command buffer, stop all motion      \\x10 main menu
+                \\x12 search origin     \\x15 back to origin     \\x14 command mode 14     \\x05 state query
+            \\x12/\\x14/\\x15 are only accepted in the main menu state \\x10, homing returns to \\x10 when finished.
+            command lines (mode 14 only, terminated by \\n)
+                G00 Jn=..       joint p2p move          G20 X=.. ..D=..   cartesian p2p move
+                G21 X=.. ..D=.. cartesian line move     G07 VE=/AC=/DE=/GCM=  motion parameters / return data mode
+                Jn+ Jn- Jn0     jog joint n / stop jogging
+            G00/G20/G21 are buffered and executed one after another, each line is echoed when it starts executing;
+            other lines are executed and echoed at once. Errors are answered with 'ERR <reason>'.
+            While in \\x12/\\x14/\\x15 the pose is streamed at a fixed rate as 'J1=.. J6=..' (GCM=0)
+            or 'X=.. D=..' (GCM=1) lines. There are no kinematics: joint and cartesian poses move independently.
+Usage: python sanxi_emulator.py [--rate HZ] [--motion-time S] [--latency S]
+Author: Mr SoSimple
+"""
+
+import argparse
+import heapq
+import os
+import select
+import threading
+import time
+import tty
+from collections import deque
+
+
+class SanxiEmulator(object):
+    CONTROL_CODES = b'\x30\x10\x12\x14\x15\x05'
+    HOME_JOINTS = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    HOME_CARTESIAN = [300.0, 0.0, 400.0, 180.0, 0.0, 0.0, 0.0]
+
+    def __init__(self, rate=50.0, motion_time=1.0, latency=0.0, homing_time=2.0, jog_speed=10.0, buffer_size=16):
+        """
+        :param rate: 坐标流发送频率(Hz)
+        :param motion_time: 每条 G00/G20/G21 运动耗时(s)
+        :param latency: 控制器应答延迟(s)
+        :param homing_time: 搜寻原点/回原点耗时(s)
+        :param jog_speed: 单轴点动速度(度/s)
+        :param buffer_size: 运动命令缓冲区容量，溢出时应答 'ERR buffer overflow'
+        """
+        super(SanxiEmulator, self).__init__()
+        self.rate = rate
+        self.motion_time = motion_time
+        self.latency = latency
+        self.homing_time = homing_time
+        self.jog_speed = jog_speed
+        self.buffer_size = buffer_size
+        self.port_name = None
+        # 控制器状态
+        self.state = b'\x10'
+        self.joints = list(self.HOME_JOINTS)
+        self.cartesian = list(self.HOME_CARTESIAN)
+        self.params = {'VE': 0.0, 'AC': 0.0, 'DE': 0.0, 'GCM': 1}
+        self.received_lines = []  # 收到的全部命令行，便于检查
+        self.__command_buffer = deque()
+        self.__motion = None  # (space, start, target, t_start, duration, done_state)
+        self.__jogging = {}  # 关节序号 -> 方向 +1/-1
+        self.__line = bytearray()
+        self.__outbox = []  # 延迟发送堆：(due, seq, data)
+        self.__out_seq = 0
+        self.__master = None
+        self.__slave = None
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """
+        打开 pty 并在后台线程中运行仿真器
+        :return: string, 供 Sanxi.connect_sanxi() 使用的串口名
+        """
+        self.__open_pty()
+        self.__thread = threading.Thread(target=self.__run, name='Sanxi_Emulator')
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self.port_name
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        for fd in (self.__master, self.__slave):
+            if fd is not None:
+                os.close(fd)
+        self.__master = self.__slave = None
+
+    def __open_pty(self):
+        self.__master, self.__slave = os.openpty()
+        tty.setraw(self.__slave)
+        os.set_blocking(self.__master, False)
+        self.port_name = os.ttyname(self.__slave)
+
+    ##############################main loop##############################
+    def __run(self):
+        period = 1.0 / self.rate
+        next_tick = time.monotonic()
+        last = next_tick
+        while not self.__stopped.is_set():
+            now = time.monotonic()
+            timeout = next_tick - now
+            if self.__outbox:
+                timeout = min(timeout, self.__outbox[0][0] - now)
+            readable, _, _ = select.select([self.__master], [], [], max(0.0, min(timeout, 0.01)))
+            if readable:
+                try:
+                    data = os.read(self.__master, 4096)
+                except OSError:
+                    data = b''
+                for byte in data:
+                    self.__feed(byte)
+            now = time.monotonic()
+            self.__update_motion(now, now - last)
+            last = now
+            if now >= next_tick:
+                next_tick += period
+                if next_tick < now:
+                    next_tick = now + period
+                if self.state in b'\x12\x14\x15':
+                    self.__reply(self.__pose_line())
+            self.__flush_outbox(now)
+
+    def __reply(self, data):
+        heapq.heappush(self.__outbox, (time.monotonic() + self.latency, self.__out_seq, data))
+        self.__out_seq += 1
+
+    def __flush_outbox(self, now):
+        while self.__outbox and self.__outbox[0][0] <= now:
+            data = heapq.heappop(self.__outbox)[2]
+            try:
+                os.write(self.__master, data)
+            except OSError:
+                pass  # 上位机未读取，与真实串口一样丢弃
+
+    ##############################protocol##############################
+    def __feed(self, byte):
+        if not self.__line and byte in self.CONTROL_CODES:
+            self.__control(bytes([byte]))
+        elif byte == 0x0a:
+            line = self.__line.decode(errors='replace').strip()
+            self.__line.clear()
+            if line:
+                self.__command(line)
+        else:
+            self.__line.append(byte)
+
+    def __control(self, code):
+        if code == b'\x30':
+            self.__command_buffer.clear()
+            self.__motion = None
+            self.__jogging.clear()
+            self.state = code
+        elif code == b'\x10':
+            self.state = code
+        elif code in b'\x12\x15':
+            if self.state == b'\x10':
+                self.state = code
+                self.__motion = ('joint', list(self.joints), list(self.HOME_JOINTS),
+                                 time.monotonic(), self.homing_time, b'\x10')
+        elif code == b'\x14':
+            if self.state == b'\x10':
+                self.state = code
+        self.__reply(self.state)
+
+    def __command(self, line):
+        self.received_lines.append(line)
+        if self.state != b'\x14':
+            self.__reply('ERR not in mode 14: {}\r\n'.format(line).encode())
+            return
+        words = line.split()
+        head = words[0].upper()
+        try:
+            if head in ('G00', 'G20', 'G21'):
+                self.__parse_target(head, words[1:])  # 先检查格式
+                if len(self.__command_buffer) >= self.buffer_size:
+                    self.__reply('ERR buffer overflow: {}\r\n'.format(line).encode())
+                else:
+                    self.__command_buffer.append(line)
+                return
+            if head == 'G07':
+                for word in words[1:]:
+                    key, value = word.split('=')
+                    if key not in self.params:
+                        raise ValueError(key)
+                    self.params[key] = int(float(value)) if key == 'GCM' else float(value)
+            elif len(head) == 3 and head[0] == 'J' and head[1] in '123456' and head[2] in '+-0':
+                n = int(head[1])
+                if head[2] == '0':
+                    self.__jogging.pop(n, None)
+                else:
+                    self.__jogging[n] = 1 if head[2] == '+' else -1
+            else:
+                raise ValueError(head)
+        except (ValueError, IndexError):
+            self.__reply('ERR bad command: {}\r\n'.format(line).encode())
+            return
+        self.__reply((line + '\r\n').encode())
+
+    def __parse_target(self, head, words):
+        if head == 'G00':
+            keys, target = ['J1', 'J2', 'J3', 'J4', 'J5', 'J6'], list(self.joints)
+        else:
+            keys, target = ['X', 'Y', 'Z', 'A', 'B', 'C', 'D'], list(self.cartesian)
+        for word in words:
+            key, value = word.split('=')
+            target[keys.index(key.upper())] = float(value)
+        return target
+
+    def __update_motion(self, now, dt):
+        if self.__motion is None and self.__command_buffer and self.state == b'\x14':
+            # 开始执行缓冲区中的下一条运动命令
+            line = self.__command_buffer.popleft()
+            words = line.split()
+            head = words[0].upper()
+            space = 'joint' if head == 'G00' else 'cartesian'
+            start = self.joints if space == 'joint' else self.cartesian
+            self.__motion = (space, list(start), self.__parse_target(head, words[1:]), now, self.motion_time, None)
+            self.__reply((line + '\r\n').encode())
+        if self.__motion is not None:
+            space, start, target, t_start, duration, done_state = self.__motion
+            ratio = min(1.0, (now - t_start) / duration) if duration > 0 else 1.0
+            pose = [a + (b - a) * ratio for a, b in zip(start, target)]
+            if space == 'joint':
+                self.joints = pose
+            else:
+                self.cartesian = pose
+            if ratio >= 1.0:
+                self.__motion = None
+                if done_state is not None:
+                    # 回原点结束，发出最终位姿后回到主菜单状态
+                    self.cartesian = list(self.HOME_CARTESIAN)
+                    self.__reply(self.__pose_line())
+                    self.state = done_state
+        for n, direction in self.__jogging.items():
+            self.joints[n - 1] += direction * self.jog_speed * dt
+
+    def __pose_line(self):
+        if self.params['GCM'] == 0:
+            values = self.joints
+            keys = ['J1', 'J2', 'J3', 'J4', 'J5', 'J6']
+        else:
+            values = self.cartesian
+            keys = ['X', 'Y', 'Z', 'A', 'B', 'C', 'D']
+        return (' '.join('{}={:.3f}'.format(k, v) for k, v in zip(keys, values)) + '\r\n').encode()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SANXI robot controller emulator on a pty')
+    parser.add_argument('--rate', type=float, default=50.0, help='pose streaming rate (Hz)')
+    parser.add_argument('--motion-time', type=float, default=1.0, help='duration of each G00/G20/G21 move (s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='reply latency (s)')
+    parser.add_argument('--homing-time', type=float, default=2.0, help='duration of search/back to origin (s)')
+    parser.add_argument('--buffer-size', type=int, default=16, help='motion command buffer size')
+    args = parser.parse_args()
+    emulator = SanxiEmulator(rate=args.rate, motion_time=args.motion_time, latency=args.latency,
+                             homing_time=args.homing_time, buffer_size=args.buffer_size)
+    emulator.start()
+    print('Sanxi emulator listening on', emulator.port_name)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -0,0 +1,124 @@
+"""
+This module includes the reordering of a batch of targets to minimize the total motion time.
+The time of every move between two targets is estimated at once as a matrix, from a rest-to-rest trapezoidal
+velocity profile: the slowest joint for joint targets, the X Y Z distance for cartesian targets.
+A route starting at the current pose is built by nearest neighbour and improved by 2-opt; targets listed in
+`fixed` keep their relative order (others may be visited between them).
+Class: SequenceResult   order (indices into the targets), original_time, optimized_time (s)
+Functions: time_matrix() optimize_sequence()
+Author: Mr SoSimple
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from motion_estimator import trapezoid_time
+
+
+SequenceResult = namedtuple('SequenceResult', ['order', 'original_time', 'optimized_time'])
+
+
+def time_matrix(points, v_max, a_max, space='joint'):
+    """
+    两两之间的运动时间
+    :param points: (n, 6) 关节角，或 (n, 6)/(n, 7) 直角坐标位姿
+    :param space: 'joint'——各关节同步，取最慢的关节；'cartesian'——按 X Y Z 直线距离
+    :return: (n, n)
+    """
+    points = np.asarray(points, dtype=float)
+    if space == 'joint':
+        deltas = np.abs(points[:, None, :6] - points[None, :, :6]).max(axis=2)
+    else:
+        deltas = np.linalg.norm(points[:, None, :3] - points[None, :, :3], axis=2)
+    return trapezoid_time(deltas, v_max, a_max)
+
+
+def _route_time(costs, route):
+    route = np.asarray(route)
+    return float(costs[route[:-1], route[1:]].sum())
+
+
+def _nearest_neighbour(costs, n, fixed):
+    # 节点 0 为起点，目标为 1..n；固定顺序的目标只有轮到时才可选
+    position = {node: i for i, node in enumerate(fixed)}
+    visited = np.zeros(n + 1, dtype=bool)
+    visited[0] = True
+    candidates = np.ones(n + 1, dtype=bool)
+    candidates[0] = False
+    candidates[list(fixed[1:])] = False
+    route = [0]
+    for _ in range(n):
+        choice = np.where(candidates & ~visited, costs[route[-1]], np.inf)
+        node = int(np.argmin(choice))
+        visited[node] = True
+        route.append(node)
+        if node in position and position[node] + 1 < len(fixed):
+            candidates[fixed[position[node] + 1]] = True
+    return route
+
+
+def _two_opt(costs, route, is_fixed, max_rounds):
+    """
+    开放路径的 2-opt：反转 route[i..j]，每轮对每个 i 向量化计算全部 j 的收益；
+    反转段中含 2 个及以上固定顺序的目标时不反转
+    """
+    route = np.array(route)
+    n = len(route)
+    for _ in range(max_rounds):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = route[i - 1], route[i]
+            j = np.arange(i + 1, n)
+            c = route[j]
+            d = np.append(route[i + 2:], -1)  # 反转到末尾时后面没有节点
+            gain = costs[a, b] - costs[a, c]
+            has_next = d >= 0
+            gain = gain + np.where(has_next, costs[c, np.maximum(d, 0)] - costs[b, np.maximum(d, 0)], 0.0)
+            fixed_count = np.cumsum(is_fixed[route[i:]])[1:]
+            gain[fixed_count >= 2] = 0.0
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                route[i:j[best] + 1] = route[i:j[best] + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return route.tolist()
+
+
+def optimize_sequence(targets, v_max, a_max, space='joint', start=None, fixed=(), max_rounds=50):
+    """
+    重排目标顺序使总运动时间最短
+    :param targets: (n, 6) 关节角，或 (n, 6)/(n, 7) 直角坐标位姿
+    :param v_max, a_max: 速度(度/s 或 mm/s)、加速度限值
+    :param space: 'joint' 或 'cartesian'，见 time_matrix()
+    :param start: 起点(如当前位姿)，None 为从第一个目标出发(第一个目标不动)
+    :param fixed: 保持相对顺序的目标序号(按该顺序访问)
+    :param max_rounds: 2-opt 最多轮数
+    :return: SequenceResult
+    """
+    targets = np.asarray(targets, dtype=float)
+    n = len(targets)
+    fixed = [int(index) for index in fixed]
+    if start is None:
+        # 第一个目标作为起点，其余目标参与排序
+        start = targets[0]
+        others = list(range(1, n))
+        fixed = [index for index in fixed if index != 0]
+    else:
+        others = list(range(n))
+    start = np.asarray(start, dtype=float)[:targets.shape[1]]
+    points = np.vstack((start[None, :], targets[others]))
+    costs = time_matrix(points, v_max, a_max, space)
+    # 节点编号：0 为起点，k 为 others[k - 1]
+    node_of = {index: k + 1 for k, index in enumerate(others)}
+    fixed_nodes = [node_of[index] for index in fixed]
+    is_fixed = np.zeros(len(points), dtype=bool)
+    is_fixed[fixed_nodes] = True
+    original = list(range(len(points)))
+    route = _nearest_neighbour(costs, len(others), fixed_nodes)
+    route = _two_opt(costs, route, is_fixed, max_rounds)
+    order = [others[node - 1] for node in route[1:]]
+    if len(others) < n:
+        order = [0] + order
+    return SequenceResult(order, _route_time(costs, original), _route_time(costs, route))
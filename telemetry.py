@@ -0,0 +1,66 @@
+"""
+This module includes the parser of the messages returned by SANXI robot.
+Every received frame is sorted into typed events in a single pass, dispatching on its first byte:
+    JointPose       'J1=.. J2=.. J3=.. J4=.. J5=.. J6=..'        values: tuple of 6 float
+    CartesianPose   'X=.. Y=.. Z=.. A=.. B=.. C=.. D=..'         values: tuple of 7 float
+    Status          bare state byte, e.g. '\\x10', possibly followed by another line in the same frame
+    Error           'ERR ...'
+    Echo            anything else, e.g. the echo of a sent command 'G00 J1=10'
+Class: PoseSnapshot, an immutable published pose: sequence number, timestamp and array('d') values,
+       the values are never modified after publication
+Functions: parse_frame()
+Author: Mr SoSimple
+"""
+
+from collections import namedtuple
+
+
+JointPose = namedtuple('JointPose', ['values'])
+CartesianPose = namedtuple('CartesianPose', ['values'])
+Status = namedtuple('Status', ['code'])
+Echo = namedtuple('Echo', ['text'])
+Error = namedtuple('Error', ['text'])
+PoseSnapshot = namedtuple('PoseSnapshot', ['seq', 'timestamp', 'values'])
+
+STATE_BYTES = b'\x30\x10\x12\x14\x15'
+_J = ord('J')
+_X = ord('X')
+_E = ord('E')
+
+
+def parse_frame(raw):
+    """
+    解析一帧返回消息
+    :param raw: bytes，一帧原始数据，可带 \\r\\n
+    :return: list of event，状态字节在前
+    """
+    if not raw:
+        return []
+    first = raw[0]
+    if first == _J:
+        if raw[2:3] == b'=':
+            words = raw.split()
+            if len(words) == 6:
+                try:
+                    return [JointPose(tuple([float(word[3:]) for word in words]))]
+                except ValueError:
+                    pass
+    elif first == _X:
+        if raw[1:2] == b'=':
+            words = raw.split()
+            if len(words) == 7:
+                try:
+                    return [CartesianPose(tuple([float(word[2:]) for word in words]))]
+                except ValueError:
+                    pass
+    elif first in STATE_BYTES:
+        # 状态字节不带换行符，同一帧中可能跟着下一行
+        events = [Status(chr(first))]
+        events.extend(parse_frame(raw[1:]))
+        return events
+    text = raw.decode(errors='replace').strip()
+    if not text:
+        return []
+    if first == _E and text.startswith('ERR'):
+        return [Error(text)]
+    return [Echo(text)]
@@ -0,0 +1,330 @@
+"""
+This module includes the time parameterization of multi-point joint paths and their fixed-rate streaming.
+A path through joint waypoints is timed as linear segments with parabolic blends (LSPB through via points):
+the arm passes near every via point without stopping, each joint stays within the velocity limit on the
+linear segments and within the acceleration limit in the blends, and all joints reach each via time together.
+Sampling is vectorized, so long paths are generated at once.
+The streamer sends the setpoints through command_pipeline.CommandPipeline, so no more than `window` setpoints
+are in the controller buffer; setpoints that fall behind schedule are skipped, and the stream fails as soon
+as the controller rejects one.
+The controller runs every G00 setpoint as a separate point-to-point move and frees a buffer slot only when
+a setpoint starts, so the requested rate is not guaranteed: a run that skips more than `max_skip_ratio` of
+its setpoints, or sends one later than `max_jitter`, ends as DEGRADED instead of FINISHED.
+The controller's motion parameters (VE/AC/DE, see sanxi_core.Sanxi.set_motion_para) are converted to
+degrees with UNITS_PER_DEGREE, or to mm for line moves with UNITS_PER_MM.
+Class: JointTrajectory      sample() setpoints(), a timed path
+       TrajectoryStreamer   start() stop() cancel() wait() get_stats(), sends the setpoints at a requested rate
+Functions: motion_limits() plan_joint_path()
+Author: Mr SoSimple
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from command_pipeline import CommandPipeline
+
+
+UNITS_PER_DEGREE = 1000.0  # 控制器速度/加速度参数的单位：1/1000 度
+UNITS_PER_MM = 1000.0  # 直线运动时的单位：1/1000 mm
+
+
+def motion_limits(ve, ac, de, units=UNITS_PER_DEGREE):
+    """
+    控制器运动参数换算为限值
+    :param ve, ac, de: 控制器单位的速度、加速度、减速度，即 G07 VE=/AC=/DE= 的值
+    :param units: UNITS_PER_DEGREE 得到关节限值，UNITS_PER_MM 得到直线运动限值
+    :return: (v_max 度/s 或 mm/s, a_max 度/s^2 或 mm/s^2)，加减速取二者中较小者
+    """
+    return ve / units, min(ac, de) / units
+
+
+class JointTrajectory(object):
+    def __init__(self, waypoints, via_times, starts, velocities, accelerations, positions):
+        """
+        由 plan_joint_path() 生成
+        :param waypoints: (n, 6) 路径点
+        :param via_times: (n,) 各路径点对应的时刻(s)
+        :param starts: (6, m) 各关节每段多项式的起始时刻
+        :param velocities, accelerations, positions: (6, m) 各段起点的速度、加速度与位置
+        """
+        super(JointTrajectory, self).__init__()
+        self.waypoints = waypoints
+        self.via_times = via_times
+        self.duration = float(via_times[-1])
+        self.__starts = starts
+        self.__velocities = velocities
+        self.__accelerations = accelerations
+        self.__positions = positions
+
+    def sample(self, times):
+        """
+        :param times: float 或 (k,) 时刻(s)，超出 [0, duration] 时取端点
+        :return: (positions, velocities)，(6,)/(k, 6) 度与度/s
+        """
+        times = np.clip(np.asarray(times, dtype=float), 0.0, self.duration)
+        single = times.ndim == 0
+        times = times.reshape(-1)
+        positions = np.empty((len(times), 6))
+        velocities = np.empty((len(times), 6))
+        for joint in range(6):
+            starts = self.__starts[joint]
+            piece = np.clip(np.searchsorted(starts, times, 'right') - 1, 0, len(starts) - 1)
+            dt = times - starts[piece]
+            v0 = self.__velocities[joint, piece]
+            acc = self.__accelerations[joint, piece]
+            positions[:, joint] = self.__positions[joint, piece] + v0 * dt + 0.5 * acc * dt * dt
+            velocities[:, joint] = v0 + acc * dt
+        if single:
+            return positions[0], velocities[0]
+        return positions, velocities
+
+    def setpoints(self, rate):
+        """
+        按固定频率采样
+        :param rate: Hz
+        :return: (times, positions)，(k,) 与 (k, 6)，最后一点为终点
+        """
+        times = np.arange(0.0, self.duration, 1.0 / rate)
+        times = np.append(times, self.duration)
+        return times, self.sample(times)[0]
+
+
+def _segment_durations(deltas, v_max, a_max):
+    # 各关节按梯形速度曲线单独运动所需时间，取最慢的关节
+    distance = np.abs(deltas)
+    return (distance / v_max + v_max / a_max).max(axis=1) * (distance.max(axis=1) > 0)
+
+
+def _blends(points, durations, a_max):
+    """
+    计算一个关节的 LSPB 参数
+    :param points: (n,) 路径点
+    :param durations: (n-1,) 各段时长
+    :return: (blend_times (n,), linear_velocities (n-1,), blend_accelerations (n,))；时长不足时返回 None
+    """
+    n = len(points)
+    deltas = np.diff(points)
+    accelerations = np.zeros(n)
+    blend_times = np.zeros(n)
+    velocities = np.zeros(n - 1)
+    if n == 2:
+        # 单段：对称的梯形速度曲线
+        a = np.sign(deltas[0]) * a_max
+        if a:
+            root = durations[0] ** 2 - 4.0 * deltas[0] / a
+            if root < 0:
+                return None
+            blend_times[:] = (durations[0] - np.sqrt(root)) / 2.0
+            velocities[0] = deltas[0] / (durations[0] - blend_times[0])
+            accelerations[:] = [a, -a]
+        return blend_times, velocities, accelerations
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 首段：从静止加速
+        accelerations[0] = np.sign(deltas[0]) * a_max
+        if accelerations[0]:
+            root = durations[0] ** 2 - 2.0 * deltas[0] / accelerations[0]
+            if root < 0:
+                return None
+            blend_times[0] = durations[0] - np.sqrt(root)
+            velocities[0] = deltas[0] / (durations[0] - blend_times[0] / 2.0)
+        # 末段：减速到静止
+        accelerations[-1] = np.sign(-deltas[-1]) * a_max
+        if accelerations[-1]:
+            root = durations[-1] ** 2 + 2.0 * deltas[-1] / accelerations[-1]
+            if root < 0:
+                return None
+            blend_times[-1] = durations[-1] - np.sqrt(root)
+            velocities[-1] = deltas[-1] / (durations[-1] - blend_times[-1] / 2.0)
+        # 中间段匀速
+        velocities[1:-1] = np.where(durations[1:-1] > 0, deltas[1:-1] / durations[1:-1], 0.0)
+        change = np.diff(velocities)
+        accelerations[1:-1] = np.sign(change) * a_max
+        blend_times[1:-1] = np.abs(change) / a_max
+    # 各段匀速部分的时长不能为负
+    linear = durations - blend_times[:-1] * np.array([1.0] + [0.5] * (n - 2)) \
+        - blend_times[1:] * np.array([0.5] * (n - 2) + [1.0])
+    if (linear < -1e-9).any():
+        return None
+    return blend_times, velocities, accelerations
+
+
+def plan_joint_path(waypoints, v_max, a_max):
+    """
+    多点关节路径的时间参数化，经过中间点时不停止
+    :param waypoints: (n, 6) 关节角(度)，n >= 2
+    :param v_max: 最大关节速度(度/s)
+    :param a_max: 最大关节加速度(度/s^2)
+    :return: JointTrajectory
+    """
+    waypoints = np.asarray(waypoints, dtype=float).reshape(-1, 6)
+    if len(waypoints) < 2:
+        raise ValueError('a path needs at least 2 waypoints')
+    # 去掉重复点，否则该段时长为零
+    keep = np.concatenate(([True], np.abs(np.diff(waypoints, axis=0)).max(axis=1) > 1e-9))
+    waypoints = waypoints[keep]
+    if len(waypoints) < 2:
+        waypoints = np.vstack((waypoints, waypoints))
+    durations = np.maximum(_segment_durations(np.diff(waypoints, axis=0), v_max, a_max), 1e-6)
+    # 混合段放不下时加长相邻段，通常不需要或只需几次
+    for _ in range(100):
+        blends = [_blends(waypoints[:, joint], durations, a_max) for joint in range(6)]
+        if all(blend is not None for blend in blends):
+            break
+        durations *= 1.1
+    else:
+        raise ValueError('cannot time the path within the limits')
+    via_times = np.concatenate(([0.0], np.cumsum(durations)))
+    n = len(waypoints)
+    pieces = 2 * n - 1  # 混合段与匀速段交替
+    starts = np.empty((6, pieces))
+    velocities = np.zeros((6, pieces))
+    accelerations = np.zeros((6, pieces))
+    positions = np.empty((6, pieces))
+    for joint, (blend_times, linear_velocities, blend_accelerations) in enumerate(blends):
+        # 混合段的起止时刻：首段从 0 开始，末段在终点结束，中间以路径点时刻为中心
+        blend_start = via_times - blend_times / 2.0
+        blend_start[0] = 0.0
+        blend_start[-1] = via_times[-1] - blend_times[-1]
+        blend_end = blend_start + blend_times
+        starts[joint, 0::2] = blend_start
+        starts[joint, 1::2] = blend_end[:-1]
+        accelerations[joint, 0::2] = blend_accelerations
+        piece_durations = np.diff(np.append(starts[joint], via_times[-1]))
+        # 逐段积分得到各段起点的速度与位置
+        velocities[joint, 1:] = np.cumsum(accelerations[joint] * piece_durations)[:-1]
+        moves = velocities[joint] * piece_durations + 0.5 * accelerations[joint] * piece_durations ** 2
+        positions[joint, 0] = waypoints[0, joint]
+        positions[joint, 1:] = waypoints[0, joint] + np.cumsum(moves)[:-1]
+    return JointTrajectory(waypoints, via_times, starts, velocities, accelerations, positions)
+
+
+class TrajectoryStreamer(object):
+    # 运行状态
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
+    DEGRADED = 'degraded'  # 发送完毕，但跳过的设定点或发送时刻偏差超过界限
+
+    def __init__(self, sanxi, trajectory, rate=50.0, window=8, max_skip_ratio=0.1, max_jitter=None):
+        """
+        :param sanxi: 已连接并已 start_update_sanxi_output() 的 sanxi_core.Sanxi
+        :param trajectory: JointTrajectory
+        :param rate: 发送频率(Hz)，应不高于控制器能接收的命令频率
+        :param window: 在途设定点数，应不大于控制器运动命令缓冲区容量
+        :param max_skip_ratio: 允许跳过的设定点比例
+        :param max_jitter: 允许的最大发送时刻偏差(s)，None 为一个发送周期
+        """
+        super(TrajectoryStreamer, self).__init__()
+        self.sanxi = sanxi
+        self.trajectory = trajectory
+        self.rate = rate
+        self.max_skip_ratio = max_skip_ratio
+        self.max_jitter = 1.0 / rate if max_jitter is None else max_jitter
+        self.times, self.positions = trajectory.setpoints(rate)
+        self.pipeline = CommandPipeline(sanxi, window)
+        self.state = None
+        self.error = None  # 第一个被拒绝的设定点 (命令, 异常)
+        self.degraded = None  # DEGRADED 的原因
+        self.__stopped = threading.Event()
+        self.__thread = None
+        self.__lateness = []  # 每个设定点实际发送时刻与计划时刻之差(s)
+        self.__skipped = 0
+
+    def start(self):
+        self.sanxi.changeto_mode14()
+        self.state = self.RUNNING
+        self.__thread = threading.Thread(target=self.__run, name='Sanxi_Trajectory')
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def cancel(self):
+        """
+        停止发送，不等待发送线程，可在任意线程调用(如 Sanxi.stop())；已在控制器缓冲区中的设定点由调用者中止
+        """
+        self.__stopped.set()
+        self.pipeline.cancel()
+
+    def stop(self):
+        self.cancel()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+    def wait(self, timeout=None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        return self.__thread is None or not self.__thread.is_alive()
+
+    def __rejected(self):
+        errors = self.pipeline.get_errors()
+        if errors and self.error is None:
+            self.error = errors[0]
+            print('Trajectory error: ', 'setpoint {0} rejected: {1}'.format(*errors[0]))
+        return bool(errors)
+
+    def __run(self):
+        # 按计划时刻发送，不累积误差；落后超过一个周期的设定点被跳过，终点总是发送；
+        # 在途设定点达到窗口时等待控制器回送，有设定点被拒绝即停止
+        period = 1.0 / self.rate
+        lines = ['G00 ' + ' '.join('J{0}={1:.3f}'.format(i + 1, value) for i, value in enumerate(row)) + '\n'
+                 for row in self.positions.tolist()]
+        start = time.perf_counter()
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            if self.__rejected():
+                break
+            due = start + float(self.times[i])
+            delay = due - time.perf_counter()
+            if delay > 0:
+                if self.__stopped.wait(delay):
+                    break
+            elif self.__stopped.is_set():
+                break
+            elif -delay > period and i != last:
+                self.__skipped += 1
+                continue
+            while self.pipeline.submit(line, timeout=0.1) is None:
+                if self.__stopped.is_set() or self.__rejected():
+                    break
+            else:
+                self.__lateness.append(time.perf_counter() - due)
+                continue
+            break
+        while not self.__stopped.is_set() and not self.pipeline.drain(timeout=0.1):
+            pass
+        if self.__rejected():
+            self.state = self.FAILED
+        elif self.__stopped.is_set():
+            self.state = self.CANCELLED
+        else:
+            self.degraded = self.__degraded()
+            if self.degraded is not None:
+                print('Trajectory error: ', self.degraded)
+            self.state = self.FINISHED if self.degraded is None else self.DEGRADED
+
+    def __degraded(self):
+        # 没有按计划的频率执行：跳过的设定点过多，或发送时刻落后过多(终点总是发送，其偏差即总的超时)
+        ratio = self.__skipped / float(len(self.times)) if len(self.times) else 0.0
+        if ratio > self.max_skip_ratio:
+            return '{0} of {1} setpoints skipped ({2:.0%} > {3:.0%})'.format(
+                self.__skipped, len(self.times), ratio, self.max_skip_ratio)
+        lateness = max(self.__lateness) if self.__lateness else 0.0
+        if lateness > self.max_jitter:
+            return 'setpoint sent {0:.0f} ms late (> {1:.0f} ms)'.format(lateness * 1e3, self.max_jitter * 1e3)
+        return None
+
+    def get_stats(self):
+        """
+        :return: dict，state 运行状态，degraded 为 DEGRADED 的原因，sent 已发送设定点数，skipped 跳过数，
+                 rejected 被拒绝(或回送超时)数，jitter_mean/jitter_max 发送时刻偏差(ms)
+        """
+        lateness = list(self.__lateness)
+        stats = {'state': self.state, 'degraded': self.degraded, 'setpoints': len(self.times), 'sent': len(lateness),
+                 'skipped': self.__skipped, 'rejected': self.pipeline.get_stats()['failed']}
+        if lateness:
+            stats['jitter_mean_ms'] = sum(lateness) / len(lateness) * 1e3
+            stats['jitter_max_ms'] = max(lateness) * 1e3
+        return stats
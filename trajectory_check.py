@@ -0,0 +1,141 @@
+"""
+This module includes the pre-flight check of whole trajectories, before anything is sent to the SANXI robot.
+A trajectory is checked in one vectorized pass against the joint limits, the workspace box and the reach
+of the arm (see kinematics.py); cartesian waypoints are also solved with batched inverse kinematics.
+The result names the first offending waypoint.
+The default limits and workspace are those set with kinematics.configure(); without them the checks raise
+kinematics.CalibrationError.
+Class: CheckResult      ok, index (first offending waypoint or None), reason, joints ((N, 6) joint angles or None)
+Functions: check_joints() check_poses() check_workspace()
+Author: Mr SoSimple
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+import kinematics
+
+
+CheckResult = namedtuple('CheckResult', ['ok', 'index', 'reason', 'joints'])
+
+
+def _first(bad, reason_func):
+    """
+    :param bad: (N,) bool
+    :return: (index, reason) 或 None
+    """
+    indices = np.flatnonzero(bad)
+    if not len(indices):
+        return None
+    index = int(indices[0])
+    return index, reason_func(index)
+
+
+def _first_failure(failures):
+    # 多项检查中取最靠前的违规点
+    failures = [failure for failure in failures if failure is not None]
+    if not failures:
+        return None
+    return min(failures, key=lambda failure: failure[0])
+
+
+def _limit_failure(joints, limits):
+    low = joints < limits[:, 0]
+    high = joints > limits[:, 1]
+
+    def reason(index):
+        axis = int(np.flatnonzero(low[index] | high[index])[0])
+        return 'J{0}={1:.3f} outside joint limits [{2:.1f}, {3:.1f}]'.format(
+            axis + 1, joints[index, axis], limits[axis, 0], limits[axis, 1])
+    return _first((low | high).any(axis=1), reason)
+
+
+def _workspace_failure(positions, workspace):
+    outside = (positions < workspace[:, 0]) | (positions > workspace[:, 1])
+
+    def reason(index):
+        axis = int(np.flatnonzero(outside[index])[0])
+        return '{0}={1:.3f} outside workspace [{2:.1f}, {3:.1f}]'.format(
+            'XYZ'[axis], positions[index, axis], workspace[axis, 0], workspace[axis, 1])
+    return _first(outside.any(axis=1), reason)
+
+
+def check_workspace(positions, workspace=None):
+    """
+    只检查末端位置是否在工作空间内，值为 nan 的轴不检查
+    :param positions: (N, 3) 或 (N, 6) 位置 X Y Z ...
+    :param workspace: (3, 2) 工作空间，None 为 kinematics.WORKSPACE
+    :return: CheckResult，joints 为 None
+    """
+    positions = np.asarray(positions, dtype=float)
+    positions = positions.reshape(-1, positions.shape[-1])[:, :3]
+    if workspace is None:
+        kinematics.require_configured()
+        workspace = kinematics.WORKSPACE
+    failure = _workspace_failure(positions, workspace)
+    if failure is None:
+        return CheckResult(True, None, None, None)
+    return CheckResult(False, failure[0], failure[1], None)
+
+
+def check_joints(joints, limits=None, workspace=None):
+    """
+    检查关节空间路径：关节限位，以及正运动学得到的末端位置是否在工作空间内
+    :param joints: (N, 6) 关节角(度)
+    :param limits: (6, 2) 关节限位，None 为 kinematics.JOINT_LIMITS
+    :param workspace: (3, 2) 工作空间，None 为 kinematics.WORKSPACE
+    :return: CheckResult
+    :raise kinematics.CalibrationError: 尚未设置几何参数
+    """
+    joints = np.asarray(joints, dtype=float).reshape(-1, 6)
+    kinematics.require_configured()
+    limits = kinematics.JOINT_LIMITS if limits is None else np.asarray(limits, dtype=float)
+    workspace = kinematics.WORKSPACE if workspace is None else np.asarray(workspace, dtype=float)
+    positions = kinematics.fk_matrices(joints).reshape(-1, 4, 4)[:, :3, 3]
+    failure = _first_failure([_limit_failure(joints, limits), _workspace_failure(positions, workspace)])
+    if failure is None:
+        return CheckResult(True, None, None, joints)
+    return CheckResult(False, failure[0], failure[1], joints)
+
+
+def check_poses(poses, seed=None, limits=None, workspace=None, ik_cache=None):
+    """
+    检查直角坐标路径：工作空间、臂展、逆解是否收敛及其关节限位
+    :param poses: (N, 6) 位姿 X Y Z A B C，多出的列(如外部轴 D)被忽略
+    :param seed: (6,) 逆解初值(度)，通常为当前关节角，None 为零位
+    :param limits: (6, 2) 关节限位，None 为 kinematics.JOINT_LIMITS
+    :param workspace: (3, 2) 工作空间，None 为 kinematics.WORKSPACE
+    :param ik_cache: ik_cache.IKCache，None 为不用缓存
+    :return: CheckResult，joints 为各点的逆解
+    :raise kinematics.CalibrationError: 尚未设置几何参数
+    """
+    poses = np.asarray(poses, dtype=float)
+    poses = poses.reshape(-1, poses.shape[-1])[:, :6]
+    kinematics.require_configured()
+    limits = kinematics.JOINT_LIMITS if limits is None else np.asarray(limits, dtype=float)
+    workspace = kinematics.WORKSPACE if workspace is None else np.asarray(workspace, dtype=float)
+    seed = np.zeros(6) if seed is None else np.asarray(seed, dtype=float)
+    # 先做不需要逆解的检查，违规点之后的路径不再求解
+    distance = np.linalg.norm(poses[:, :3] - kinematics.SHOULDER, axis=1)
+    failure = _first_failure([
+        _workspace_failure(poses[:, :3], workspace),
+        _first(distance > kinematics.REACH, lambda index: 'distance {0:.3f} mm beyond reach {1:.1f} mm'.format(
+            distance[index], kinematics.REACH))])
+    end = len(poses) if failure is None else failure[0]
+    solve = kinematics.ik if ik_cache is None else ik_cache.ik_batch
+    joints = np.zeros((len(poses), 6))
+    converged = np.zeros(len(poses), dtype=bool)
+    if end:
+        joints[:end], converged[:end] = solve(poses[:end], np.broadcast_to(seed, (end, 6)))
+        # 未收敛的点以前一个点的解为初值再解一次
+        retry = np.flatnonzero(~converged[1:end]) + 1
+        if len(retry):
+            joints[retry], converged[retry] = solve(poses[retry], joints[retry - 1])
+    failure = _first_failure([
+        failure,
+        _first(~converged[:end], lambda index: 'no inverse kinematics solution'),
+        _limit_failure(joints[:end], limits)])
+    if failure is None:
+        return CheckResult(True, None, None, joints)
+    return CheckResult(False, failure[0], failure[1], joints)